@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the LISP interpreter in lab.py
+
+Macro benchmarks run whole programs (the sudoku solver, scripted
+minesweeper games, closures, deep recursion and big lists); micro
+benchmarks time one interpreter operation at a time.  Usage:
+
+    python3 bench.py [--engine vm] [--repeat N] [--warmup N] [--only GLOB]
+                     [--slow] [--json] [--save PATH] [--baseline PATH]
+                     [--threshold X]
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import fnmatch
+import platform
+import statistics
+import tracemalloc
+from itertools import repeat
+
+import lab
+
+TEST_DIRECTORY = os.path.dirname(__file__)
+
+# name -> (layer, operations per run, setup); setup() prepares the state a
+# benchmark needs and returns a thunk doing one run
+benchmarks = {}
+# the benchmarks that take seconds per run, left out unless asked for
+slow_benchmarks = set()
+
+
+def benchmark(name, layer, number=1, slow=False):
+    def register(setup):
+        benchmarks[name] = (layer, number, setup)
+        if slow:
+            slow_benchmarks.add(name)
+        return setup
+
+    return register
+
+
+def source(text):
+    return lab.parse(lab.tokenize(text))
+
+
+def data_file(name):
+    return os.path.join(TEST_DIRECTORY, "test_files", name)
+
+
+def loaded_frame(name):
+    frame = lab.make_global_frame()
+    lab.evaluate_file(data_file(name), frame)
+    return frame
+
+
+def evaluator(text, frame=None):
+    """
+    A thunk evaluating text in frame (by default, a fresh global frame made
+    once), optimizer and all, the way the REPL would.
+    """
+    tree = source(text)
+    if frame is None:
+        frame = lab.make_global_frame()
+    return lambda: lab.evaluate(tree, frame)
+
+
+def repeated(text, number, frame=None):
+    """
+    A thunk running the compiled form of text number times in frame,
+    without the optimizer, so each run does exactly the operation written.
+    """
+    if frame is None:
+        frame = lab.make_global_frame()
+    compiled = lab.engines[lab.default_engine](source(text), False, frame.scope)
+
+    def run():
+        for _ in repeat(None, number):
+            compiled(frame)
+
+    return run
+
+
+###################
+# Macro benchmarks
+###################
+
+
+def sudoku(board):
+    return lambda: evaluator(f"(solve-sudoku {board})", loaded_frame("sudoku.scm"))
+
+
+for _board in range(1, 5):
+    benchmark(f"sudoku-board{_board}", "macro", slow=_board in (2, 3))(
+        sudoku(f"board{_board}")
+    )
+
+
+@benchmark("ndmines", "macro")
+def ndmines():
+    # a flood fill over most of a 6x6x6 board, a small reveal, then a bomb
+    return evaluator(
+        """
+        (begin
+          (define game (new-game-nd (list 6 6 6)
+            (list (list 0 0 0) (list 5 5 5) (list 2 3 1) (list 4 0 2))))
+          (dig-nd game (list 5 0 0))
+          (dig-nd game (list 0 5 0))
+          (dig-nd game (list 2 3 1))
+          (game-get-state game))
+        """,
+        loaded_frame("ndmines.scm"),
+    )
+
+
+@benchmark("counters", "macro")
+def counters():
+    with open(os.path.join(TEST_DIRECTORY, "test_inputs", "61.scm")) as f:
+        trees = lab.parse_all(lab.tokenize(f.read()))
+
+    def run():
+        frame = lab.make_global_frame()
+        for tree in trees:
+            lab.evaluate(tree, frame)
+
+    return run
+
+
+@benchmark("deep-recursion", "macro")
+def deep_recursion():
+    return evaluator(
+        """
+        (begin
+          (define (sum-to n) (if (equal? n 0) 0 (+ n (sum-to (- n 1)))))
+          (sum-to 2000))
+        """
+    )
+
+
+@benchmark("tail-loop", "macro")
+def tail_loop():
+    return evaluator(
+        """
+        (begin
+          (define (loop n acc) (if (equal? n 0) acc (loop (- n 1) (+ acc 1))))
+          (loop 100000 0))
+        """
+    )
+
+
+@benchmark("big-list", "macro")
+def big_list():
+    return evaluator(
+        """
+        (begin
+          (define (build n acc) (if (equal? n 0) acc (build (- n 1) (cons n acc))))
+          (define xs (build 100000 nil))
+          (define squares
+            (map (lambda (x) (* x x)) (filter (lambda (x) (> x 50000)) xs)))
+          (+ (fold-left + 0 squares) (length (sort (reverse xs) <))))
+        """
+    )
+
+
+###################
+# Micro benchmarks
+###################
+
+
+@benchmark("tokenize", "micro", 10)
+def tokenize():
+    with open(data_file("sudoku.scm")) as f:
+        text = f.read()
+
+    def run():
+        for _ in repeat(None, 10):
+            lab.tokenize(text)
+
+    return run
+
+
+@benchmark("parse", "micro", 10)
+def parse():
+    with open(data_file("sudoku.scm")) as f:
+        tokens = lab.tokenize(f.read())
+
+    def run():
+        for _ in repeat(None, 10):
+            lab.parse(tokens)
+
+    return run
+
+
+@benchmark("lookup", "micro", 10000)
+def lookup():
+    frame = lab.make_global_frame()
+    lab.evaluate(source("(define x 1)"), frame)
+    return repeated("x", 10000, frame)
+
+
+@benchmark("call", "micro", 10000)
+def call():
+    frame = lab.make_global_frame()
+    lab.evaluate(source("(define (f x) x)"), frame)
+    return repeated("(f 1)", 10000, frame)
+
+
+@benchmark("cons", "micro", 10000)
+def cons():
+    return repeated("(cons 1 2)", 10000)
+
+
+##############
+# Measurement
+##############
+
+
+def measure(thunk, number=1, repeat=5, warmup=1):
+    """
+    Seconds per operation of repeat timed runs of thunk (each doing number
+    operations), after warmup untimed runs.
+    """
+    for _ in range(warmup):
+        thunk()
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        thunk()
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+
+def measure_memory(thunk):
+    """
+    Peak traced memory in bytes, and the number of Pairs and local frames
+    allocated and of calls made, during one run of thunk.  This run is
+    separate from the timed ones: tracing slows everything down.
+    """
+    counter = lab.Budget()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        lab.run_budgeted(counter, thunk)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_bytes": peak,
+        "allocations": counter.allocations,
+        "calls": counter.steps,
+    }
+
+
+def run_benchmarks(
+    names=None, repeat=5, warmup=1, memory=True, engine=None, slow=False
+):
+    """
+    Run the benchmarks named by names (glob patterns; by default all but the
+    slow ones, or all of them with slow) and return a JSON-ready report: the
+    settings used, and for each benchmark its layer, operations per run,
+    min/median/mean/stdev seconds per operation and, with memory, the
+    results of measure_memory.
+    """
+    previous = lab.default_engine
+    if engine is not None:
+        lab.set_engine(engine)
+    try:
+        results = {}
+        for name, (layer, number, setup) in benchmarks.items():
+            if names and not any(
+                fnmatch.fnmatchcase(name, pattern) for pattern in names
+            ):
+                continue
+            if not names and not slow and name in slow_benchmarks:
+                continue
+            thunk = setup()
+            samples = measure(thunk, number, repeat, warmup)
+            result = {
+                "layer": layer,
+                "number": number,
+                "min": min(samples),
+                "median": statistics.median(samples),
+                "mean": statistics.mean(samples),
+                "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+            }
+            if memory:
+                result.update(measure_memory(thunk))
+            results[name] = result
+        return {
+            "engine": lab.default_engine,
+            "optimizer": lab.optimizer_enabled,
+            "python": platform.python_version(),
+            "repeat": repeat,
+            "warmup": warmup,
+            "benchmarks": results,
+        }
+    finally:
+        lab.set_engine(previous)
+
+
+def compare(report, baseline, threshold=0.1):
+    """
+    Compare the median times in report with those in baseline (an earlier
+    report), returning (name, old, new, ratio, verdict) for each benchmark
+    in both.  The verdict is "slower" when new is more than threshold (a
+    fraction) above old, "faster" when it is that much below, else "same".
+    """
+    rows = []
+    old_results = baseline["benchmarks"]
+    for name, result in report["benchmarks"].items():
+        if name not in old_results:
+            continue
+        old, new = old_results[name]["median"], result["median"]
+        ratio = new / old if old else float("inf")
+        if ratio > 1 + threshold:
+            verdict = "slower"
+        elif ratio < 1 - threshold:
+            verdict = "faster"
+        else:
+            verdict = "same"
+        rows.append((name, old, new, ratio, verdict))
+    return rows
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f}{unit}"
+    return f"{seconds / 1e-9:.1f}ns"
+
+
+def main(argv):
+    """
+    Command line entry point (see the module docstring).  Prints a table of
+    results, or the JSON report with --json; --save writes the report to a
+    file for later use as a --baseline.  Exits with status 1 if any
+    benchmark is slower than the baseline by more than --threshold.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="bench.py")
+    parser.add_argument(
+        "--engine", choices=sorted(lab.engines), default=lab.default_engine
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--only", action="append", metavar="GLOB", help="benchmarks to run"
+    )
+    parser.add_argument(
+        "--slow", action="store_true", help="also run the slow benchmarks"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the memory pass"
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--save", metavar="PATH", help="write the report to PATH")
+    parser.add_argument(
+        "--baseline", metavar="PATH", help="compare with a saved report"
+    )
+    parser.add_argument("--threshold", type=float, default=0.1)
+    options = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        options.only,
+        options.repeat,
+        options.warmup,
+        not options.no_memory,
+        options.engine,
+        options.slow,
+    )
+    if options.save:
+        with open(options.save, mode="w") as file:
+            json.dump(report, file, indent=2)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for name, result in report["benchmarks"].items():
+            line = (
+                f"{name:16} {result['layer']:6}"
+                f" median {format_time(result['median']):>10}"
+                f"  min {format_time(result['min']):>10}"
+                f"  stdev {format_time(result['stdev']):>10}"
+            )
+            if "peak_bytes" in result:
+                line += (
+                    f"  peak {result['peak_bytes'] / 1024:9.1f}KiB"
+                    f"  allocs {result['allocations']}"
+                )
+            print(line)
+
+    if options.baseline is None:
+        return 0
+    with open(options.baseline) as file:
+        baseline = json.load(file)
+    rows = compare(report, baseline, options.threshold)
+    for name, old, new, ratio, verdict in rows:
+        print(
+            f"{name:16} {format_time(old):>10} -> {format_time(new):>10}"
+            f"  x{ratio:.2f}  {verdict}",
+            file=sys.stderr,
+        )
+    return 1 if any(row[4] == "slower" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,13 +3,32 @@
 """
 #!/usr/bin/env python3
 
+import io
+import os
+import re
 import sys
+import json
+import asyncio
+import atexit
+import signal
+import time
+import threading
 import doctest
+import hashlib
+import marshal
+import mmap
+import pickle
+import tempfile
+import copyreg
+import operator
+import itertools
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+from array import array
 
 sys.setrecursionlimit(20_000)
 
-# NO ADDITIONAL IMPORTS!
-
 #############################
 # Scheme-related Exceptions #
 #############################
@@ -50,7 +69,22 @@ class SchemeEvaluationError(SchemeError):
     pass
 
 
+class SchemeBudgetError(SchemeError):
+    """
+    Exception to be raised when an evaluation goes over one of the limits of
+    its Budget.
+    """
+
+    pass
+
+
 class Frame:
+    # global and builtin frames are keyed by name; frames created by calls
+    # and let are LocalFrames with slots resolved at compile time.  A global
+    # frame and its builtins share the Rebinds its optimized lambdas check
+    scope = None
+    rebinds = None
+
     def __init__(self):
         self.mappings = {}
         self.parent = None
@@ -58,16 +92,19 @@ class Frame:
 
     def __getitem__(self, key):
         if isinstance(key, str):
-            try:
-                return self.mappings[key]
-            except:
-                if self.parent == None:
-                    raise SchemeNameError
-                return self.parent[key]
+            frame = self
+            while frame is not None:
+                mappings = frame.mappings
+                if key in mappings:
+                    return mappings[key]
+                frame = frame.parent
+            raise SchemeNameError
         else:
             return key
 
     def __setitem__(self, key, val):
+        if self.rebinds is not None and key in self.rebinds.dependents:
+            self.rebinds.rebind(key)
         self.mappings[key] = val
 
     def __contains__(self, val):
@@ -80,6 +117,8 @@ class Frame:
                 return False
 
     def __delitem__(self, val):
+        if self.rebinds is not None and val in self.rebinds.dependents:
+            self.rebinds.rebind(val)
         try:
             del self.mappings[val]
         except:
@@ -105,35 +144,296 @@ class Frame:
 
     def get_parent_from_key(self, key):
         if isinstance(key, str):
-            try:
-                self.mappings[key]
-                return self
-            except:
-                if self.parent == None:
-                    raise SchemeNameError
-                return self.parent.get_parent_from_key(key)
+            frame = self
+            while frame is not None:
+                if key in frame.mappings:
+                    return frame
+                frame = frame.parent
+            raise SchemeNameError
         else:
             return key
 
 
+# marks a slot in a LocalFrame whose name has not been defined yet (or has
+# been deleted); lookups fall through to the enclosing frames
+UNBOUND = object()
+
+
+class Scope:
+    """
+    Compile-time layout of a LocalFrame: the parameters of a lambda or the
+    variables of a let, followed by every name its body may define, plus the
+    enclosing scope (None for the global frame).  A lambda's scope also
+    records how profilers should label the function (its define name or
+    its source text); a let's has None.  A lambda the optimizer rewrote
+    keeps its Unoptimized, which Function checks before each call.
+    """
+
+    __slots__ = ("names", "index", "parent", "padding", "function", "unoptimized")
+
+    def __init__(self, params, body, parent, function=None) -> None:
+        names = list(params)
+        for name in find_defines(body):
+            if name not in names:
+                names.append(name)
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.parent = parent
+        self.padding = [UNBOUND] * (len(names) - len(params))
+        self.function = function
+        self.unoptimized = None
+
+    def resolve(self, name):
+        """
+        Return (depth, index) of the slot holding name, or (depth, None)
+        where depth is the number of local frames above the global frame.
+        """
+        depth = 0
+        scope = self
+        while scope is not None:
+            index = scope.index.get(name)
+            if index is not None:
+                return depth, index
+            scope = scope.parent
+            depth += 1
+        return depth, None
+
+
+class LocalFrame:
+    """
+    Frame for a function call or let, storing its variables in a list laid
+    out by its Scope.  Name-based access is supported for the rare paths
+    (unbound slots, deleted names) and mirrors Frame.
+    """
+
+    __slots__ = ("scope", "parent", "values")
+
+    def __init__(self, scope, parent, values) -> None:
+        if budget is not None:
+            budget.allocate()
+        self.scope = scope
+        self.parent = parent
+        self.values = values
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return key
+        index = self.scope.index.get(key)
+        if index is not None:
+            val = self.values[index]
+            if val is not UNBOUND:
+                return val
+        return self.parent[key]
+
+    def __setitem__(self, key, val):
+        index = self.scope.index.get(key)
+        if index is None:
+            raise SchemeEvaluationError
+        self.values[index] = val
+
+    def __contains__(self, val):
+        index = self.scope.index.get(val)
+        if index is not None and self.values[index] is not UNBOUND:
+            return True
+        return val in self.parent
+
+    def __delitem__(self, val):
+        index = self.scope.index.get(val)
+        if index is None or self.values[index] is UNBOUND:
+            raise SchemeNameError
+        self.values[index] = UNBOUND
+
+    def get_parent(self):
+        return self.parent
+
+    def get_map(self):
+        return {
+            name: self.values[index]
+            for name, index in self.scope.index.items()
+            if self.values[index] is not UNBOUND
+        }
+
+    def get_parent_from_key(self, key):
+        if not isinstance(key, str):
+            return key
+        index = self.scope.index.get(key)
+        if index is not None and self.values[index] is not UNBOUND:
+            return self
+        return self.parent.get_parent_from_key(key)
+
+
+def find_defines(tree):
+    """
+    Yield every name that evaluating tree may define in the current frame,
+    without looking inside nested lambda or let bodies (which get their own
+    frames).
+    """
+    if not isinstance(tree, FORM_TYPES) or not tree:
+        return
+    head = tree[0]
+    if head == "lambda":
+        return
+    if head in ("define", "define-memo") and len(tree) > 1:
+        name = tree[1]
+        if isinstance(name, FORM_TYPES):
+            if name:
+                yield name[0]
+            return
+        yield name
+        for expression in tree[2:]:
+            yield from find_defines(expression)
+        return
+    if head == "let" and len(tree) > 1:
+        if isinstance(tree[1], FORM_TYPES):
+            for binding in tree[1]:
+                if isinstance(binding, FORM_TYPES) and len(binding) == 2:
+                    yield from find_defines(binding[1])
+        return
+    for expression in tree:
+        yield from find_defines(expression)
+
+
 class Function:
-    def __init__(self, frame, expression, args) -> None:
+    def __init__(self, frame, expression, args, body, scope, name=None) -> None:
         self.args = args
         self.expression = expression
         self.frame = frame
+        self.body = body
+        self.scope = scope
+        # the name it was defined under, or None for an anonymous lambda
+        self.name = name
 
     def __call__(self, args):
+        if tracing:
+            return call_traced(self, args)
+        # bodies are compiled in tail position, so a call in tail position
+        # hands back a TailCall instead of growing the Python stack; keep
+        # running those here until a real value comes back
+        func = self
+        coerce = False
+        while True:
+            if len(args) != len(func.args):
+                raise SchemeEvaluationError
+            scope = func.scope
+            if scope.padding:
+                args = args + scope.padding
+            body = func.body
+            if scope.unoptimized is not None and scope.unoptimized.stale:
+                body = scope.unoptimized.fallback(scope)
+            result = body(LocalFrame(scope, func.frame, args))
+            if type(result) is not TailCall:
+                break
+            func = result.func
+            args = result.args
+            coerce = coerce or result.coerce
+            if type(func) is not Function:
+                result = func(args)
+                break
+        if coerce:
+            return bool(result)
+        return result
+
+    def activate(self, args):
+        """
+        Run the body once for args, returning its value or the TailCall it
+        ends with.
+        """
         if len(args) != len(self.args):
             raise SchemeEvaluationError
-        calling_frame = Frame()
-        calling_frame.set_parent(self.frame)
-        for arg_1, arg_2 in zip(self.args, args):
-            calling_frame[arg_1] = arg_2
-        return evaluate(self.expression, calling_frame)
+        scope = self.scope
+        if scope.padding:
+            args = args + scope.padding
+        body = self.body
+        # while profiling, bodies run as written, so inlined calls show up
+        if scope.unoptimized is not None and (
+            scope.unoptimized.stale or profiler is not None
+        ):
+            body = scope.unoptimized.fallback(scope)
+        return body(LocalFrame(scope, self.frame, args))
+
+    def __getstate__(self):
+        # the compiled body is a closure; it is rebuilt from the source
+        state = self.__dict__.copy()
+        state.pop("body", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.body = compile_tree(self.expression, True, self.scope)
+
+
+class TailCall:
+    """
+    A pending call to a Function, returned from a call in tail position and
+    run by the trampoline in Function.__call__.  If coerce is set, the
+    eventual result is converted to a boolean (the last operand of and/or).
+    """
+
+    __slots__ = ("func", "args", "coerce")
+
+    def __init__(self, func, args) -> None:
+        self.func = func
+        self.args = args
+        self.coerce = False
+
+
+class MemoizedFunction:
+    """
+    Wraps a procedure with a cache of its results keyed on the arguments
+    (lists and vectors by structure, see memo_key).  With max_entries set,
+    the least recently used result is evicted once the cache is full.
+    """
+
+    __slots__ = ("func", "max_entries", "cache", "hits", "misses")
+
+    def __init__(self, func, max_entries=None) -> None:
+        self.func = func
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, args):
+        key = tuple(memo_key(arg) for arg in args)
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        result = self.func(args)
+        cache[key] = result
+        if self.max_entries is not None and len(cache) > self.max_entries:
+            cache.popitem(last=False)
+        return result
+
+
+def memo_key(value):
+    """
+    A hashable key for value that is equal for structurally equal lists and
+    vectors; other values (including procedures) are keyed by their type as
+    well, so 1, 1.0 and #t (which Python considers equal) stay apart.
+    """
+    if isinstance(value, Pair):
+        items = []
+        while isinstance(value, Pair):
+            items.append(memo_key(value.car))
+            value = value.cdr
+        return (Pair, tuple(items), memo_key(value))
+    if isinstance(value, Vector):
+        return (Vector, tuple(memo_key(item) for item in value.items))
+    if isinstance(value, NDArray):
+        return (NDArray, value.shape, value.data.typecode, tuple(value.data))
+    return (type(value), value)
 
 
 class Pair:
     def __init__(self, car, cdr) -> None:
+        if tracing:
+            if budget is not None:
+                budget.allocate()
+            if green_thread is not None:
+                green_thread.work()
         self.car = car
         self.cdr = cdr
 
@@ -144,12 +444,15 @@ class Pair:
         return self.cdr
 
     def __len__(self):
+        count = 1
+        pair = self
+        while isinstance(pair.cdr, Pair):
+            count += 1
+            pair = pair.cdr
         # Scheme error cases
-        if self.cdr != None and not isinstance(self.cdr, Pair):
+        if pair.cdr is not None:
             raise SchemeEvaluationError
-        if not isinstance(self.cdr, Pair):
-            return 1
-        return 1 + len(self.cdr)
+        return count
 
     def __str__(self):
         def recursive_str(self):
@@ -160,11 +463,14 @@ class Pair:
         return str(recursive_str(self))
 
     def __getitem__(self, index):
-        if index == 0:
-            return self.car
-        if isinstance(self.cdr, Pair):
-            return self.cdr[index - 1]
-        raise SchemeEvaluationError
+        if index < 0:
+            raise SchemeEvaluationError
+        pair = self
+        for _ in range(index):
+            pair = pair.cdr
+            if not isinstance(pair, Pair):
+                raise SchemeEvaluationError
+        return pair.car
 
     def get_pair(self, index):
         if index == 0:
@@ -200,6 +506,175 @@ class Pair:
         return False
 
 
+class Vector:
+    """
+    A fixed-length Scheme vector backed by a Python list, giving constant-time
+    indexing and update.  Vectors are equal? when their elements are.
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, items) -> None:
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __eq__(self, other):
+        return isinstance(other, Vector) and self.items == other.items
+
+    __hash__ = None
+
+    def __str__(self):
+        return "#(" + " ".join(str(item) for item in self.items) + ")"
+
+    def check_index(self, index):
+        if not is_integer(index) or not 0 <= index < len(self.items):
+            raise SchemeEvaluationError
+        return index
+
+
+class NDArray:
+    """
+    A homogeneous n-dimensional array of numbers stored row-major in one
+    flat array ('q' for integers, 'd' once any element is a float), with
+    its shape and strides.  Elementwise operations and sums run over the
+    flat array.
+    """
+
+    __slots__ = ("data", "shape", "strides")
+
+    def __init__(self, data, shape) -> None:
+        self.data = data
+        self.shape = shape
+        strides = []
+        stride = 1
+        for size in reversed(shape):
+            strides.append(stride)
+            stride *= size
+        self.strides = tuple(reversed(strides))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, NDArray)
+            and self.shape == other.shape
+            and self.data.tolist() == other.data.tolist()
+        )
+
+    __hash__ = None
+
+    def __str__(self):
+        return "#<ndarray " + "x".join(map(str, self.shape)) + ">"
+
+    def offset(self, coordinates):
+        if len(coordinates) != len(self.shape):
+            raise SchemeEvaluationError
+        offset = 0
+        for coordinate, size, stride in zip(coordinates, self.shape, self.strides):
+            if not isinstance(coordinate, int) or not 0 <= coordinate < size:
+                raise SchemeEvaluationError
+            offset += coordinate * stride
+        return offset
+
+    def store(self, value):
+        # the value to put in the array, widening it to floats if need be
+        if not isinstance(value, (int, float)):
+            raise SchemeEvaluationError
+        if self.data.typecode == "q" and (
+            isinstance(value, float) or not -(2**63) <= value < 2**63
+        ):
+            self.data = array("d", self.data)
+        return value
+
+
+class Promise:
+    """
+    A delayed computation, created by delay or cons-stream.  The thunk runs
+    the first time the promise is forced and its value is remembered.
+    """
+
+    __slots__ = ("thunk", "value", "forced")
+
+    def __init__(self, thunk=None, value=None, forced=False) -> None:
+        self.thunk = thunk
+        self.value = value
+        self.forced = forced
+
+    def force(self):
+        if not self.forced:
+            value = self.thunk()
+            # forcing may have re-entered this promise; the first result wins
+            if not self.forced:
+                self.value = value
+                self.forced = True
+                self.thunk = None
+        return self.value
+
+    def __str__(self):
+        return "#<promise>"
+
+
+class Delayed:
+    """
+    The thunk of a promise made by delay or cons-stream in the closure
+    engine: body, compiled from expression in scope, run in frame.  Like a
+    Function, it is serialized as its source and recompiled when loaded.
+    """
+
+    __slots__ = ("body", "expression", "scope", "frame")
+
+    def __init__(self, body, expression, scope, frame) -> None:
+        self.body = body
+        self.expression = expression
+        self.scope = scope
+        self.frame = frame
+
+    def __call__(self):
+        return self.body(self.frame)
+
+    def __getstate__(self):
+        return (self.expression, self.scope, self.frame)
+
+    def __setstate__(self, state):
+        self.expression, self.scope, self.frame = state
+        self.body = compile_tree(self.expression, False, self.scope)
+
+
+class DelayedCall:
+    """
+    The thunk of a promise made by a stream builtin: calls func with args.
+    """
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, args) -> None:
+        self.func = func
+        self.args = args
+
+    def __call__(self):
+        return self.func(self.args)
+
+    def __getstate__(self):
+        return (self.func, self.args)
+
+    def __setstate__(self, state):
+        self.func, self.args = state
+
+
+def pair_values(list_):
+    """
+    Return the elements of a Scheme list as a Python list, walking the cdr
+    chain once; raises SchemeEvaluationError if list_ is not a proper list.
+    """
+    values = []
+    while isinstance(list_, Pair):
+        values.append(list_.car)
+        list_ = list_.cdr
+    if list_ is not None:
+        raise SchemeEvaluationError
+    return values
+
+
 ############################
 # Tokenization and Parsing #
 ############################
@@ -228,6 +703,59 @@ def number_or_symbol(value):
             return value
 
 
+# first characters of the tokens that may be numbers (int and float also
+# accept other Unicode digits, and float the words inf, infinity and nan,
+# which are checked separately); any other token is a symbol
+NUMBER_START = frozenset("0123456789+-.")
+FLOAT_WORDS = frozenset(("inf", "infinity", "nan"))
+INTEGER_PATTERN = re.compile(r"-?[0-9]+")
+
+
+def atom(token):
+    """
+    Classify a token other than a parenthesis: like number_or_symbol, but
+    symbols, the common case, are told apart from numbers by their first
+    character instead of by two failed conversions, and are interned, so
+    equal names are one object and frame lookups and special form dispatch
+    compare them by identity.
+
+    >>> atom('8'), atom('-5.32'), atom('1.2.3.4'), atom('x'), atom('inf')
+    (8, -5.32, '1.2.3.4', 'x', inf)
+    >>> atom('define') is sys.intern('def' + 'ine')
+    True
+    """
+    first = token[0]
+    if first in NUMBER_START or first.isdigit():
+        if INTEGER_PATTERN.fullmatch(token):
+            return int(token)
+        value = number_or_symbol(token)
+        if value is not token:
+            return value
+    elif first in "iInN" and token.lower() in FLOAT_WORDS:
+        return float(token)
+    return sys.intern(token)
+
+
+def interned(mapping):
+    """
+    A copy of mapping with its keys interned, so that the symbols atom
+    returns find them by identity.
+    """
+    return {sys.intern(key): value for key, value in mapping.items()}
+
+
+# the types a parsed S-expression may have: parse builds lists, and
+# iter_forms(tokens, compact=True) tuples, which load_forms caches
+FORM_TYPES = (list, tuple)
+
+
+# a token is a parenthesis or a run of anything else up to whitespace, a
+# parenthesis, or a comment; comments run from ';' to the end of the line
+TOKEN_PATTERN = re.compile(r";[^\n]*|([()]|[^\s();]+)")
+SCAN_PATTERN = re.compile(r"(\n)|([()])|([^\s();]+)|;[^\n]*|[^\S\n]+")
+CHUNK_SIZE = 1 << 16
+
+
 def tokenize(source):
     """
     Splits an input string into meaningful tokens (left parens, right parens,
@@ -235,71 +763,107 @@ def tokenize(source):
 
     Arguments:
         source (str): a string containing the source code of a Scheme
-                      expression
-    """
-    token = list(source)
-    new_token = []
-    temp_str = ""
-    next_line = False
-    for entry in token:
-        if entry == "\n":
-            next_line = False
-            if temp_str != "":
-                new_token.append(temp_str)
-            temp_str = ""
-            continue
-        if next_line:
-            continue
-        if entry == "(":
-            if temp_str != "":
-                new_token.append(temp_str)
-            temp_str = ""
-            new_token.append(entry)
-            continue
-        if entry == ")":
-            if temp_str != "":
-                new_token.append(temp_str)
-            temp_str = ""
-            new_token.append(entry)
-            continue
-        if entry == ";":
-            next_line = True
-            continue
-        if entry != " ":
-            temp_str += entry
-            continue
-        if temp_str != "":
-            new_token.append(temp_str)
-            temp_str = ""
-    if temp_str != "":
-        new_token.append(temp_str)
-    return new_token
+                      expression (or a file object or iterable of chunks,
+                      see generate_tokens)
+    """
+    if isinstance(source, str):
+        return [token for token in TOKEN_PATTERN.findall(source) if token]
+    return [token for token, _ in generate_tokens(source)]
 
 
-def find_matching_parentheses(tokens):
-    stack = []
-    matches = {}
+def generate_tokens(source):
+    """
+    Lazily yields (token, (line, column)) pairs, with 1-based positions of
+    the first character of each token.
+
+    Arguments:
+        source: a string, a file object (read in CHUNK_SIZE pieces), or an
+                iterable of string chunks; tokens and comments may be split
+                across chunk boundaries
+    """
+    if isinstance(source, str):
+        chunks = (source,)
+    elif hasattr(source, "read"):
+        chunks = iter(lambda: source.read(CHUNK_SIZE), "")
+    else:
+        chunks = source
+    line = 1
+    line_start = 0  # offset of the first character of the current line
+    offset = 0  # offset of buffer[0] in the whole source
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        end = len(buffer)
+        consumed = 0
+        for match in SCAN_PATTERN.finditer(buffer):
+            newline, paren, atom = match.groups()
+            if match.end() == end and paren is None:
+                # this token, comment or space may continue in the next chunk
+                break
+            consumed = match.end()
+            if newline:
+                line += 1
+                line_start = offset + consumed
+            elif paren or atom:
+                token = paren or atom
+                yield token, (line, offset + match.start() - line_start + 1)
+        else:
+            consumed = end
+        offset += consumed
+        buffer = buffer[consumed:]
+    for match in SCAN_PATTERN.finditer(buffer):
+        newline, paren, atom = match.groups()
+        if paren or atom:
+            yield paren or atom, (line, offset + match.start() - line_start + 1)
+
 
-    for i, token in enumerate(tokens):
+def iter_forms(tokens, compact=False):
+    """
+    Lazily yields each top-level expression in a sequence of tokens as soon
+    as its closing parenthesis is read, using the same representation as
+    parse.  Runs in a single pass with an explicit stack, so neither time nor
+    Python stack depth grows with the nesting of the source.
+
+    Arguments:
+        tokens (iterable): strings representing tokens
+        compact (bool): build S-expressions as tuples rather than lists (see
+                        FORM_TYPES); they take less memory, which matters
+                        for forms that are kept, like cached files
+    """
+    stack = []
+    current = None
+    for token in tokens:
         if token == "(":
-            stack.append(i)
+            if current is not None:
+                stack.append(current)
+            current = []
         elif token == ")":
-            if len(stack) == 0:
+            if current is None:
                 raise SchemeSyntaxError
+            expression = tuple(current) if compact else current
+            if stack:
+                current = stack.pop()
+                current.append(expression)
             else:
-                matches[stack.pop()] = i
-
-    if len(stack) > 0:
+                yield expression
+                current = None
+        elif current is None:
+            yield atom(token)
+        else:
+            current.append(atom(token))
+    if current is not None:
         raise SchemeSyntaxError
 
-    return matches
 
+def parse_all(tokens):
+    """
+    Parses a sequence of tokens into a list of every top-level expression it
+    contains (see iter_forms).
 
-def get_last_parenthesis(tokens):
-    matchings = find_matching_parentheses(tokens)
-    if not matchings:
-        raise SchemeSyntaxError
-    return matchings[min(matchings)]
+    Arguments:
+        tokens (iterable): strings representing tokens
+    """
+    return list(iter_forms(tokens))
 
 
 def parse(tokens):
@@ -312,27 +876,10 @@ def parse(tokens):
     Arguments:
         tokens (list): a list of strings representing tokens
     """
-    if len(tokens) == 1 and tokens[0] != "(" and tokens[0] != ")":
-        return number_or_symbol(tokens[0])
-    if get_last_parenthesis(tokens) != len(tokens) - 1:
+    forms = parse_all(tokens)
+    if len(forms) != 1:
         raise SchemeSyntaxError
-
-    def parse_expression(index):
-        if index >= len(tokens):
-            return []
-        if tokens[index] == "(":
-            group = []
-            other_paren_index = find_matching_parentheses(tokens)[index]
-            return [group + parse_expression(index + 1)] + parse_expression(
-                other_paren_index + 1
-            )
-        if tokens[index] == ")":
-            return []
-
-        return [number_or_symbol(tokens[index])] + parse_expression(index + 1)
-
-    parsed_expression = parse_expression(0)
-    return parsed_expression[0]
+    return forms[0]
 
 
 ######################
@@ -415,9 +962,10 @@ def cdr(args):
 
 
 def make_list(args):
-    if len(args) == 0:
-        return None
-    return cons([args[0], make_list(args[1:])])
+    result = None
+    for arg in reversed(args):
+        result = Pair(arg, result)
+    return result
 
 
 def length(args):
@@ -425,6 +973,8 @@ def length(args):
         raise SchemeEvaluationError
     if args[0] is None:
         return 0
+    if isinstance(args[0], Vector):
+        return len(args[0])
     if not isinstance(args[0], Pair):
         raise SchemeEvaluationError
     return len(args[0])
@@ -442,7 +992,6 @@ def append(args):
     if args[0] is None:
         for i, arg in enumerate(args[1:]):
             if isinstance(arg, Pair):
-                print(args)
                 return arg.append(args[1:][i + 1 :])
         return None
     if not isinstance(args[0], Pair):
@@ -450,174 +999,3755 @@ def append(args):
     return args[0].append(args[1:])
 
 
-def evaluate_file(text, frame=None):
-    file = open(text, mode="r")
-    to_text = file.read()
-    print("I'm read:", to_text)
-    token = tokenize(to_text)
-    parsed = parse(token)
-    return evaluate(parsed, frame)
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
 
 
-scheme_builtins = {
-    "+": sum,
-    "-": lambda args: -args[0] if len(args) == 1 else (args[0] - sum(args[1:])),
-    "*": multiply,
-    "/": divide,
-    "equal?": equal,
-    ">": decreasing,
-    ">=": nonincreasing,
-    "<": increasing,
-    "<=": nondecreasing,
-    "#f": False,
-    "#t": True,
-    "not": not_,
-    "cons": cons,
-    "car": car,
-    "cdr": cdr,
-    "nil": None,
-    "list": make_list,
-    "list?": lambda l: len(l) == 1
-    and (l[0] is None or (isinstance(l[0], Pair) and l[0].is_list())),
-    "length": length,
-    "list-ref": get_index,
-    "append": append,
-    "begin": lambda i: i[-1],
-}
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
 
-#############
-# Evaluation
-##############
+def range_(args):
+    """
+    (range stop), (range start stop) or (range start stop step): a list of
+    integers with the same meaning as Python's range.
+    """
+    if not 1 <= len(args) <= 3 or not all(is_integer(arg) for arg in args):
+        raise SchemeEvaluationError
+    if len(args) == 3 and args[2] == 0:
+        raise SchemeEvaluationError
+    return make_list(range(*args))
 
 
-def result_and_frame(tree, frame=None):
-    if frame == None:
-        frame = Frame()
-        built_in_frame = Frame()
-        built_in_frame.set_map(scheme_builtins.copy())
-        frame.set_parent(built_in_frame)
+def iota(args):
+    """
+    (iota count [start [step]]): count numbers starting from start (default
+    0), each step (default 1) more than the last.
+    """
+    if not 1 <= len(args) <= 3 or not is_integer(args[0]) or args[0] < 0:
+        raise SchemeEvaluationError
+    if not all(is_number(arg) for arg in args[1:]):
+        raise SchemeEvaluationError
+    start = args[1] if len(args) > 1 else 0
+    step = args[2] if len(args) > 2 else 1
+    return make_list([start + i * step for i in range(args[0])])
+
+
+def reverse(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    result = None
+    list_ = args[0]
+    while isinstance(list_, Pair):
+        result = Pair(list_.car, result)
+        list_ = list_.cdr
+    if list_ is not None:
+        raise SchemeEvaluationError
+    return result
 
-    return (evaluate(tree, frame), frame)
+
+def list_tail(args):
+    if len(args) != 2 or not is_integer(args[1]) or args[1] < 0:
+        raise SchemeEvaluationError
+    list_ = args[0]
+    for _ in range(args[1]):
+        if not isinstance(list_, Pair):
+            raise SchemeEvaluationError
+        list_ = list_.cdr
+    return list_
 
 
-def evaluate(tree, frame=None):
+def member(args):
     """
-    Evaluate the given syntax tree according to the rules of the Scheme
-    language.
+    (member x list): the first sublist of list whose car is equal to x, or
+    #f if there is none.
+    """
+    if len(args) != 2:
+        raise SchemeEvaluationError
+    value, list_ = args
+    while isinstance(list_, Pair):
+        if list_.car == value:
+            return list_
+        list_ = list_.cdr
+    if list_ is not None:
+        raise SchemeEvaluationError
+    return False
 
-    Arguments:
-        tree (type varies): a fully parsed expression, as the output from the
-                            parse function
+
+def assoc(args):
     """
-    if frame == None:
-        frame = Frame()
-        built_in_frame = Frame()
-        built_in_frame.set_map(scheme_builtins.copy())
-        frame.set_parent(built_in_frame)
-    if not isinstance(tree, list):
-        return frame[tree]
-    else:  # If Input is a list
-        if not tree:
+    (assoc key alist): the first pair in alist whose car is equal to key,
+    or #f if there is none.
+    """
+    if len(args) != 2:
+        raise SchemeEvaluationError
+    key, list_ = args
+    while isinstance(list_, Pair):
+        entry = list_.car
+        if not isinstance(entry, Pair):
             raise SchemeEvaluationError
-        if tree[0] == "define":
-            name = tree[1]
-            if isinstance(name, list):
-                equivalence = ["define", name[0], ["lambda", name[1:], tree[2]]]
-                val = evaluate(equivalence, frame)
-                return val
-            val = evaluate(tree[2], frame)
-            frame[name] = val
-            return val
-        if tree[0] == "lambda":
-            args = tree[1]
-            expression = tree[2]
-            return Function(frame, expression, args)
-        if tree[0] == "and":
-            for expression in tree[1:]:
-                if not evaluate(expression, frame):
-                    return False
-            return True
-        if tree[0] == "or":
-            for expression in tree[1:]:
-                if evaluate(expression, frame):
-                    return True
-            return False
-        if tree[0] == "if":
-            pred = tree[1]
-            true_exp = tree[2]
-            false_exp = tree[3]
-            if evaluate(pred, frame):
-                return evaluate(true_exp, frame)
+        if entry.car == key:
+            return entry
+        list_ = list_.cdr
+    if list_ is not None:
+        raise SchemeEvaluationError
+    return False
+
+
+def last_pair(args):
+    if len(args) != 1 or not isinstance(args[0], Pair):
+        raise SchemeEvaluationError
+    list_ = args[0]
+    while isinstance(list_.cdr, Pair):
+        list_ = list_.cdr
+    return list_
+
+
+def list_copy(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    return make_list(pair_values(args[0]))
+
+
+class SortKey:
+    """
+    Wraps a value so Python's sort (Timsort) orders it with a Scheme
+    less-than procedure.  Timsort only ever compares with <, so each
+    comparison costs one call.
+    """
+
+    __slots__ = ("value", "less")
+
+    def __init__(self, value, less) -> None:
+        self.value = value
+        self.less = less
+
+    def __lt__(self, other):
+        if green_thread is not None:
+            green_thread.work()
+        return self.less([self.value, other.value])
+
+
+def sort(args):
+    """
+    (sort sequence [less? [key]]): a new list (or vector, for a vector) of
+    the elements of sequence in stable order by less? (default <), comparing
+    (key element) instead of the element itself when key is given.
+    """
+    if not 1 <= len(args) <= 3 or not all(callable(arg) for arg in args[1:]):
+        raise SchemeEvaluationError
+    sequence = args[0]
+    values = sequence.items if isinstance(sequence, Vector) else pair_values(sequence)
+    less = args[1] if len(args) > 1 else None
+    key = args[2] if len(args) > 2 else None
+    if key is not None:
+        keys = [key([value]) for value in values]
+    else:
+        keys = values
+    if less is not None:
+        keys = [SortKey(value, less) for value in keys]
+    try:
+        order = sorted(range(len(values)), key=keys.__getitem__)
+    except TypeError as error:
+        raise SchemeEvaluationError from error
+    result = [values[i] for i in order]
+    if isinstance(sequence, Vector):
+        return Vector(result)
+    return make_list(result)
+
+
+def list_rows(args):
+    # the rows of arguments for a procedure applied across several lists or
+    # vectors, stopping at the shortest one
+    if len(args) == 1:
+        return [[value] for value in sequence_values(args[0])]
+    return [list(values) for values in zip(*map(sequence_values, args))]
+
+
+def for_each(args):
+    if len(args) < 2 or not callable(args[0]):
+        raise SchemeEvaluationError
+    func = args[0]
+    for row in list_rows(args[1:]):
+        func(row)
+    return None
+
+
+def fold_left(args):
+    """
+    (fold-left f init list ...): (f (f (f init x1) x2) x3) and so on, with
+    one more argument to f for each extra list.
+    """
+    if len(args) < 3 or not callable(args[0]):
+        raise SchemeEvaluationError
+    func, val = args[0], args[1]
+    for row in list_rows(args[2:]):
+        val = func([val, *row])
+    return val
+
+
+def fold_right(args):
+    """
+    (fold-right f init list ...): (f x1 (f x2 (f x3 init))) and so on,
+    computed from the end of the list without recursion.
+    """
+    if len(args) < 3 or not callable(args[0]):
+        raise SchemeEvaluationError
+    func, val = args[0], args[1]
+    for row in reversed(list_rows(args[2:])):
+        val = func([*row, val])
+    return val
+
+
+def memoize(args):
+    """
+    (memoize f [max-entries]): a procedure that behaves like f but remembers
+    its results, keeping at most max-entries of them (default: no limit).
+    Rebinding f's name to it, or using define-memo, also memoizes the
+    recursive calls.
+    """
+    if not 1 <= len(args) <= 2 or not callable(args[0]):
+        raise SchemeEvaluationError
+    if len(args) == 2 and (not is_integer(args[1]) or args[1] < 1):
+        raise SchemeEvaluationError
+    return MemoizedFunction(*args)
+
+
+def pmap(args):
+    """
+    (pmap f list [chunk-size [workers]]): like (map f list), but f is applied
+    in worker processes, chunk-size elements at a time (see parallel_map).
+    """
+    if not 2 <= len(args) <= 4 or not callable(args[0]):
+        raise SchemeEvaluationError
+    if any(not is_integer(option) or option < 1 for option in args[2:]):
+        raise SchemeEvaluationError
+    return make_list(parallel_map(args[0], pair_values(args[1]), *args[2:]))
+
+
+def memo_stats(args):
+    """
+    (memo-stats f): the list (hits misses entries) for a memoized procedure.
+    """
+    if len(args) != 1 or not isinstance(args[0], MemoizedFunction):
+        raise SchemeEvaluationError
+    func = args[0]
+    return make_list([func.hits, func.misses, len(func.cache)])
+
+
+def make_vector(args):
+    if len(args) not in (1, 2) or not is_integer(args[0]) or args[0] < 0:
+        raise SchemeEvaluationError
+    fill = args[1] if len(args) == 2 else 0
+    return Vector([fill] * args[0])
+
+
+def vector_ref(args):
+    if len(args) != 2 or not isinstance(args[0], Vector):
+        raise SchemeEvaluationError
+    return args[0].items[args[0].check_index(args[1])]
+
+
+def vector_set(args):
+    if len(args) != 3 or not isinstance(args[0], Vector):
+        raise SchemeEvaluationError
+    args[0].items[args[0].check_index(args[1])] = args[2]
+    return args[2]
+
+
+def vector_length(args):
+    if len(args) != 1 or not isinstance(args[0], Vector):
+        raise SchemeEvaluationError
+    return len(args[0])
+
+
+def vector_to_list(args):
+    if len(args) != 1 or not isinstance(args[0], Vector):
+        raise SchemeEvaluationError
+    return make_list(args[0].items)
+
+
+def list_to_vector(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    return Vector(pair_values(args[0]))
+
+
+def vector_map(args):
+    if len(args) < 2 or not callable(args[0]):
+        raise SchemeEvaluationError
+    func, vectors = args[0], args[1:]
+    if not all(isinstance(vector, Vector) for vector in vectors):
+        raise SchemeEvaluationError
+    return Vector(
+        [func(list(items)) for items in zip(*(vector.items for vector in vectors))]
+    )
+
+
+def sequence_values(sequence):
+    if isinstance(sequence, Vector):
+        return sequence.items
+    return pair_values(sequence)
+
+
+def number_array(values):
+    # 'q' holds any int that fits in 64 bits; anything else is stored as 'd'
+    if all(isinstance(value, int) for value in values):
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass
+    return array("d", values)
+
+
+def make_ndarray(args):
+    """
+    (make-ndarray shape [fill]): an array with the given shape (a list or
+    vector of sizes) whose elements are all fill (default 0).
+    """
+    if len(args) not in (1, 2):
+        raise SchemeEvaluationError
+    shape = tuple(sequence_values(args[0]))
+    if not shape or not all(is_integer(size) and size > 0 for size in shape):
+        raise SchemeEvaluationError
+    fill = args[1] if len(args) == 2 else 0
+    if not isinstance(fill, (int, float)):
+        raise SchemeEvaluationError
+    count = 1
+    for size in shape:
+        count *= size
+    return NDArray(number_array([fill]) * count, shape)
+
+
+def ndarray_arg(args, count):
+    if len(args) != count or not isinstance(args[0], NDArray):
+        raise SchemeEvaluationError
+    return args[0]
+
+
+def nd_ref(args):
+    """
+    (nd-ref array coordinates): the element at coordinates, a list or vector
+    with one index per dimension.
+    """
+    array_ = ndarray_arg(args, 2)
+    return array_.data[array_.offset(sequence_values(args[1]))]
+
+
+def nd_set(args):
+    array_ = ndarray_arg(args, 3)
+    offset = array_.offset(sequence_values(args[1]))
+    array_.data[offset] = array_.store(args[2])
+    return args[2]
+
+
+def nd_fill(args):
+    array_ = ndarray_arg(args, 2)
+    value = array_.store(args[1])
+    array_.data = array(array_.data.typecode, [value]) * len(array_.data)
+    return args[1]
+
+
+def nd_shape(args):
+    return make_list(list(ndarray_arg(args, 1).shape))
+
+
+def nd_neighbors(args):
+    """
+    (nd-neighbors array coordinates): the coordinates (as lists) of every
+    cell of array within one step of coordinates in each dimension,
+    including coordinates itself.
+    """
+    array_ = ndarray_arg(args, 2)
+    coordinates = sequence_values(args[1])
+    array_.offset(coordinates)
+    ranges = [
+        range(max(0, coordinate - 1), min(size, coordinate + 2))
+        for coordinate, size in zip(coordinates, array_.shape)
+    ]
+    return make_list([make_list(list(cell)) for cell in itertools.product(*ranges)])
+
+
+def elementwise(op):
+    """
+    An (nd-op a b) builtin returning a new array of op applied to the
+    elements of a and b, where b is an array of the same shape or a number.
+    """
+
+    def nd_op(args):
+        if len(args) != 2 or not isinstance(args[0], NDArray):
+            raise SchemeEvaluationError
+        left, right = args
+        if isinstance(right, NDArray):
+            if right.shape != left.shape:
+                raise SchemeEvaluationError
+            values = map(op, left.data, right.data)
+        elif isinstance(right, (int, float)):
+            values = map(op, left.data, itertools.repeat(right))
+        else:
+            raise SchemeEvaluationError
+        return NDArray(number_array(list(values)), left.shape)
+
+    return nd_op
+
+
+def nd_sum(args):
+    return sum(ndarray_arg(args, 1).data)
+
+
+def force(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    if isinstance(args[0], Promise):
+        return args[0].force()
+    return args[0]
+
+
+def make_promise(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    if isinstance(args[0], Promise):
+        return args[0]
+    return Promise(value=args[0], forced=True)
+
+
+def stream_pair(stream):
+    if not isinstance(stream, Pair):
+        raise SchemeEvaluationError
+    return stream
+
+
+def stream_rest(stream):
+    rest = stream_pair(stream).cdr
+    if isinstance(rest, Promise):
+        return rest.force()
+    return rest
+
+
+def stream_car(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    return stream_pair(args[0]).car
+
+
+def stream_cdr(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    return stream_rest(args[0])
+
+
+def stream_map(args):
+    if len(args) < 2 or not callable(args[0]):
+        raise SchemeEvaluationError
+    func, streams = args[0], args[1:]
+    if any(stream is None for stream in streams):
+        return None
+    first = func([stream_pair(stream).car for stream in streams])
+    return Pair(first, Promise(DelayedCall(stream_map_rest, args)))
+
+
+def stream_map_rest(args):
+    func, streams = args[0], args[1:]
+    return stream_map([func, *(stream_rest(stream) for stream in streams)])
+
+
+def stream_filter(args):
+    if len(args) != 2 or not callable(args[0]):
+        raise SchemeEvaluationError
+    func, stream = args
+    # skip non-matching elements in a loop, so long gaps cost no stack
+    while stream is not None:
+        value = stream_pair(stream).car
+        if func([value]):
+            return Pair(value, Promise(DelayedCall(stream_filter_rest, [func, stream])))
+        stream = stream_rest(stream)
+    return None
+
+
+def stream_filter_rest(args):
+    func, stream = args
+    return stream_filter([func, stream_rest(stream)])
+
+
+def stream_take(args):
+    """
+    (stream-take stream n) forces the first n elements of stream (fewer if
+    it ends first) and returns them as a list.
+    """
+    if len(args) != 2 or not is_integer(args[1]) or args[1] < 0:
+        raise SchemeEvaluationError
+    stream, count = args
+    values = []
+    while stream is not None and len(values) < count:
+        values.append(stream_pair(stream).car)
+        if len(values) < count:
+            stream = stream_rest(stream)
+    return make_list(values)
+
+
+def integers_from(args):
+    if len(args) != 1:
+        raise SchemeEvaluationError
+    start = args[0]
+    return Pair(start, Promise(DelayedCall(integers_from, [start + 1])))
+
+
+def spawn(args):
+    """
+    (spawn f arg ...): start a green thread running (f arg ...) and return
+    it.  Only green threads (see evaluate_async) may spawn others.
+    """
+    if not args or not callable(args[0]) or green_thread is None:
+        raise SchemeEvaluationError
+    return green_thread.scheduler.spawn(args[0], list(args[1:]))
+
+
+def yield_(args):
+    # (yield): let the other ready green threads run first
+    if args:
+        raise SchemeEvaluationError
+    if green_thread is not None:
+        green_thread.suspend(("yield",))
+    return None
+
+
+def sleep(args):
+    if len(args) != 1 or not isinstance(args[0], (int, float)) or args[0] < 0:
+        raise SchemeEvaluationError
+    if green_thread is None:
+        time.sleep(args[0])
+    else:
+        green_thread.suspend(("sleep", args[0]))
+    return None
+
+
+def make_channel(args):
+    """
+    (make-channel [capacity]): a channel holding at most capacity values
+    (default: no limit; 0 hands each value straight from put to get).
+    """
+    if len(args) > 1 or (args and (not is_integer(args[0]) or args[0] < 0)):
+        raise SchemeEvaluationError
+    return Channel(*args)
+
+
+def channel_put(args):
+    if len(args) != 2 or not isinstance(args[0], Channel):
+        raise SchemeEvaluationError
+    args[0].put(args[1])
+    return None
+
+
+def channel_get(args):
+    if len(args) != 1 or not isinstance(args[0], Channel):
+        raise SchemeEvaluationError
+    return args[0].get()
+
+
+# header of the parsed-form cache written, when asked for, next to each source
+# file (the source path plus "c"); bump CACHE_VERSION whenever parse output
+# changes
+CACHE_MAGIC = b"SCMC"
+CACHE_VERSION = 2
+
+
+def cache_header(data):
+    version = bytes([CACHE_VERSION, marshal.version, *sys.version_info[:2]])
+    return CACHE_MAGIC + version + hashlib.sha256(data).digest()
+
+
+def load_forms(text):
+    """
+    Return a list of the top-level expressions in the file named text, as
+    compact forms (see iter_forms).  They are read from the cache file
+    text + "c" when it was written for the same contents by the same
+    interpreter version; otherwise the source is parsed and the cache is
+    (re)written.  An unwritable directory just means no cache.
+    """
+    with open(text, mode="rb") as file:
+        data = file.read()
+    header = cache_header(data)
+    cache = text + "c"
+    try:
+        with open(cache, mode="rb") as file:
+            cached = file.read()
+        if cached.startswith(header):
+            return marshal.loads(cached[len(header) :])
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    forms = list(iter_forms(tokenize(data.decode()), compact=True))
+    temp = f"{cache}.{os.getpid()}.tmp"
+    try:
+        with open(temp, mode="wb") as file:
+            file.write(header + marshal.dumps(forms))
+        os.replace(temp, cache)
+    except OSError:
+        pass
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return forms
+
+
+def evaluate_file(text, frame=None, cache=False):
+    """
+    Evaluate every top-level expression in the file named text, in order and
+    in the same frame, and return the value of the last one.  With cache, the
+    parsed forms are kept next to the file (see load_forms).
+    """
+    result = None
+    for result in evaluate_file_forms(text, frame, cache):
+        pass
+    return result
+
+
+def evaluate_file_forms(text, frame=None, cache=False):
+    """
+    Yield the value of each top-level expression in the file named text as
+    soon as it has been evaluated.  With cache, the parsed expressions come
+    from load_forms; without it (or if the source has a syntax error, so
+    the forms before it still run) the file is read in buffered chunks and
+    each expression is evaluated as soon as it has been read, so large files
+    run in memory bounded by their largest expression.
+    """
+    if frame is None:
+        frame = make_global_frame()
+    if cache:
+        try:
+            forms = load_forms(text)
+        except SchemeSyntaxError:
+            pass
+        else:
+            for tree in forms:
+                yield evaluate(tree, frame)
+            return
+    with open(text, mode="r") as file:
+        tokens = (token for token, _ in generate_tokens(file))
+        for tree in iter_forms(tokens, compact=True):
+            yield evaluate(tree, frame)
+
+
+scheme_builtins = interned({
+    "+": sum,
+    "-": lambda args: -args[0] if len(args) == 1 else (args[0] - sum(args[1:])),
+    "*": multiply,
+    "/": divide,
+    "equal?": equal,
+    ">": decreasing,
+    ">=": nonincreasing,
+    "<": increasing,
+    "<=": nondecreasing,
+    "#f": False,
+    "#t": True,
+    "not": not_,
+    "cons": cons,
+    "car": car,
+    "cdr": cdr,
+    "nil": None,
+    "list": make_list,
+    "list?": lambda l: len(l) == 1
+    and (l[0] is None or (isinstance(l[0], Pair) and l[0].is_list())),
+    "length": length,
+    "list-ref": get_index,
+    "append": append,
+    "range": range_,
+    "iota": iota,
+    "reverse": reverse,
+    "list-tail": list_tail,
+    "member": member,
+    "assoc": assoc,
+    "last-pair": last_pair,
+    "list-copy": list_copy,
+    "sort": sort,
+    "for-each": for_each,
+    "fold-left": fold_left,
+    "fold-right": fold_right,
+    "make-ndarray": make_ndarray,
+    "ndarray?": lambda args: len(args) == 1 and isinstance(args[0], NDArray),
+    "nd-shape": nd_shape,
+    "nd-ref": nd_ref,
+    "nd-set!": nd_set,
+    "nd-fill!": nd_fill,
+    "nd-neighbors": nd_neighbors,
+    "nd+": elementwise(operator.add),
+    "nd*": elementwise(operator.mul),
+    "nd-sum": nd_sum,
+    "memoize": memoize,
+    "memo-stats": memo_stats,
+    "pmap": pmap,
+    "begin": lambda i: i[-1],
+    "vector": lambda args: Vector(list(args)),
+    "vector?": lambda args: len(args) == 1 and isinstance(args[0], Vector),
+    "make-vector": make_vector,
+    "vector-ref": vector_ref,
+    "vector-set!": vector_set,
+    "vector-length": vector_length,
+    "vector->list": vector_to_list,
+    "list->vector": list_to_vector,
+    "vector-map": vector_map,
+    "force": force,
+    "make-promise": make_promise,
+    "stream-car": stream_car,
+    "stream-cdr": stream_cdr,
+    "stream-map": stream_map,
+    "stream-filter": stream_filter,
+    "stream-take": stream_take,
+    "integers-from": integers_from,
+    "spawn": spawn,
+    "yield": yield_,
+    "sleep": sleep,
+    "make-channel": make_channel,
+    "channel-put": channel_put,
+    "channel-get": channel_get,
+})
+
+# the name of each builtin procedure by identity, for serialize
+builtin_names = {
+    id(value): name for name, value in scheme_builtins.items() if callable(value)
+}
+
+
+#############
+# Evaluation
+##############
+
+
+def make_global_frame():
+    """
+    Build a fresh global frame whose parent holds a copy of the builtins.
+    """
+    frame = Frame()
+    built_in_frame = Frame()
+    built_in_frame.set_map(scheme_builtins.copy())
+    frame.set_parent(built_in_frame)
+    frame.rebinds = built_in_frame.rebinds = Rebinds()
+    return frame
+
+
+def compile_tree(tree, tail=False, scope=None):
+    """
+    Translate a parsed expression into a Python closure taking a frame.
+
+    Special forms are dispatched once here rather than every time the
+    expression is evaluated, so function bodies that run many times only pay
+    for the string comparisons when the enclosing lambda is compiled.
+    Variables are resolved against the enclosing scopes to (depth, index)
+    slots; only names bound in the global frame are looked up by name.
+
+    Arguments:
+        tree (type varies): a fully parsed expression, as the output from the
+                            parse function
+        tail (bool): whether the expression is in tail position of a function
+                     body; calls there return a TailCall to the trampoline
+        scope (Scope): layout of the frame the closure will run in, or None
+                       for the global frame
+    """
+    if isinstance(tree, str):
+        return compile_symbol(tree, scope)
+    if not isinstance(tree, FORM_TYPES):
+        return lambda frame: tree
+    if not tree:
+        return raiser(SchemeEvaluationError)
+    head = tree[0]
+    if isinstance(head, str) and head in special_forms:
+        try:
+            return special_forms[head](tree, tail, scope)
+        except (IndexError, TypeError, ValueError):
+            # malformed special forms are reported when they are evaluated,
+            # just like any other runtime error
+            return raiser(SchemeSyntaxError)
+    return compile_call(tree, tail, scope)
+
+
+def raiser(error):
+    def raise_error(frame):
+        raise error
+
+    return raise_error
+
+
+def compile_symbol(name, scope=None):
+    if scope is None:
+        return lambda frame: frame[name]
+    depth, index = scope.resolve(name)
+
+    if index is None:
+        # global (or builtin) name: skip the local frames, then look it up
+        if depth == 1:
+            return lambda frame: frame.parent[name]
+
+        def global_lookup(frame):
+            for _ in range(depth):
+                frame = frame.parent
+            return frame[name]
+
+        return global_lookup
+
+    if depth == 0:
+
+        def local(frame):
+            val = frame.values[index]
+            if val is UNBOUND:
+                return frame.parent[name]
+            return val
+
+        return local
+
+    if depth == 1:
+
+        def enclosing(frame):
+            frame = frame.parent
+            val = frame.values[index]
+            if val is UNBOUND:
+                return frame.parent[name]
+            return val
+
+        return enclosing
+
+    def nonlocal_lookup(frame):
+        for _ in range(depth):
+            frame = frame.parent
+        val = frame.values[index]
+        if val is UNBOUND:
+            return frame.parent[name]
+        return val
+
+    return nonlocal_lookup
+
+
+def compile_call(tree, tail=False, scope=None):
+    args = [compile_tree(arg, False, scope) for arg in tree[1:]]
+    if not isinstance(tree[0], (str, list, tuple)) and callable(tree[0]):
+        return compile_builtin_call(tree[0], args)
+    func = compile_tree(tree[0], False, scope)
+
+    if tail:
+
+        def tail_call(frame):
+            proc = func(frame)
+            if type(proc) is Function:
+                return TailCall(proc, [arg(frame) for arg in args])
+            if not callable(proc):
+                raise SchemeEvaluationError
+            if tracing:
+                return call_traced(proc, [arg(frame) for arg in args])
+            return proc([arg(frame) for arg in args])
+
+        return tail_call
+
+    if len(args) == 0:
+
+        def call(frame):
+            proc = func(frame)
+            if not callable(proc):
+                raise SchemeEvaluationError
+            if tracing:
+                return call_traced(proc, [])
+            return proc([])
+
+    elif len(args) == 1:
+        (arg_1,) = args
+
+        def call(frame):
+            proc = func(frame)
+            if not callable(proc):
+                raise SchemeEvaluationError
+            if tracing:
+                return call_traced(proc, [arg_1(frame)])
+            return proc([arg_1(frame)])
+
+    elif len(args) == 2:
+        arg_1, arg_2 = args
+
+        def call(frame):
+            proc = func(frame)
+            if not callable(proc):
+                raise SchemeEvaluationError
+            if tracing:
+                return call_traced(proc, [arg_1(frame), arg_2(frame)])
+            return proc([arg_1(frame), arg_2(frame)])
+
+    else:
+
+        def call(frame):
+            proc = func(frame)
+            if not callable(proc):
+                raise SchemeEvaluationError
+            if tracing:
+                return call_traced(proc, [arg(frame) for arg in args])
+            return proc([arg(frame) for arg in args])
+
+    return call
+
+
+def compile_builtin_call(proc, args):
+    # a call to a builtin the optimizer put in place of its name: no lookup,
+    # and never a TailCall, since builtins don't grow the Scheme stack
+    if len(args) == 1:
+        (arg_1,) = args
+
+        def call(frame):
+            if tracing:
+                return call_traced(proc, [arg_1(frame)])
+            return proc([arg_1(frame)])
+
+    elif len(args) == 2:
+        arg_1, arg_2 = args
+
+        def call(frame):
+            if tracing:
+                return call_traced(proc, [arg_1(frame), arg_2(frame)])
+            return proc([arg_1(frame), arg_2(frame)])
+
+    else:
+
+        def call(frame):
+            if tracing:
+                return call_traced(proc, [arg(frame) for arg in args])
+            return proc([arg(frame) for arg in args])
+
+    return call
+
+
+def compile_define(tree, tail=False, scope=None):
+    name = tree[1]
+    if isinstance(name, FORM_TYPES):
+        return compile_define(
+            ["define", name[0], ["lambda", name[1:], tree[2]]], tail, scope
+        )
+    return compile_binding(name, compile_value(tree[2], scope, name), scope)
+
+
+def compile_define_memo(tree, tail=False, scope=None):
+    name = tree[1]
+    if isinstance(name, FORM_TYPES):
+        name, tree = name[0], ["define", name[0], ["lambda", name[1:], tree[2]]]
+    (value,) = tree[2:]
+    value = compile_value(value, scope, name)
+    return compile_binding(name, lambda frame: memoize([value(frame)]), scope)
+
+
+def compile_value(tree, scope, name):
+    # the value of a define: a lambda is compiled knowing its name
+    if isinstance(tree, FORM_TYPES) and tree and tree[0] == "lambda":
+        return compile_lambda(tree, False, scope, name)
+    return compile_tree(tree, False, scope)
+
+
+def compile_binding(name, value, scope):
+    # the body of define: store what value computes under name in the frame
+    index = None if scope is None else scope.index.get(name)
+
+    if index is None:
+
+        def define(frame):
+            val = value(frame)
+            frame[name] = val
+            return val
+
+        return define
+
+    def define_local(frame):
+        val = value(frame)
+        frame.values[index] = val
+        return val
+
+    return define_local
+
+
+def compile_lambda(tree, tail=False, scope=None, name=None):
+    args = tree[1]
+    expression = source = tree[2]
+    unoptimized = optimized_from(tree)
+    if unoptimized is not None:
+        source = unoptimized.expression
+    label = function_label(name, args, source)
+    body_scope = Scope(args, source, scope, label)
+    body_scope.unoptimized = unoptimized
+    body = compile_tree(expression, True, body_scope)
+    return lambda frame: Function(frame, source, args, body, body_scope, name)
+
+
+def compile_begin(tree, tail=False, scope=None):
+    if len(tree) < 2:
+        return raiser(SchemeSyntaxError)
+    expressions = [compile_tree(expression, False, scope) for expression in tree[1:-1]]
+    last = compile_tree(tree[-1], tail, scope)
+
+    def begin(frame):
+        for expression in expressions:
+            expression(frame)
+        return last(frame)
+
+    return begin
+
+
+def compile_and(tree, tail=False, scope=None):
+    if len(tree) < 2:
+        return lambda frame: True
+    expressions = [compile_tree(expression, False, scope) for expression in tree[1:-1]]
+    last = compile_tree(tree[-1], tail, scope)
+
+    def and_(frame):
+        for expression in expressions:
+            if not expression(frame):
+                return False
+        result = last(frame)
+        if type(result) is TailCall:
+            result.coerce = True
+            return result
+        return bool(result)
+
+    return and_
+
+
+def compile_or(tree, tail=False, scope=None):
+    if len(tree) < 2:
+        return lambda frame: False
+    expressions = [compile_tree(expression, False, scope) for expression in tree[1:-1]]
+    last = compile_tree(tree[-1], tail, scope)
+
+    def or_(frame):
+        for expression in expressions:
+            if expression(frame):
+                return True
+        result = last(frame)
+        if type(result) is TailCall:
+            result.coerce = True
+            return result
+        return bool(result)
+
+    return or_
+
+
+def compile_if(tree, tail=False, scope=None):
+    pred = compile_tree(tree[1], False, scope)
+    true_exp = compile_tree(tree[2], tail, scope)
+    false_exp = compile_tree(tree[3], tail, scope)
+
+    def if_(frame):
+        if pred(frame):
+            return true_exp(frame)
+        return false_exp(frame)
+
+    return if_
+
+
+def iterate(sequence):
+    """
+    Iterate over the elements of a Scheme list (including nil) or vector,
+    walking a list's cdr chain once.
+    """
+    if sequence is None or isinstance(sequence, Pair):
+        return iterate_pairs(sequence)
+    if isinstance(sequence, Vector):
+        return iter(sequence.items)
+    raise SchemeEvaluationError
+
+
+def iterate_pairs(list_):
+    while isinstance(list_, Pair):
+        yield list_.car
+        list_ = list_.cdr
+    if list_ is not None:
+        raise SchemeEvaluationError
+
+
+def map_values(func, sequences):
+    """
+    Shared body of the map special form: a new Scheme list of func applied
+    to the first elements of each sequence, then the second ones, and so on
+    until the shortest sequence runs out.
+    """
+    if len(sequences) == 1:
+        rows = ([value] for value in iterate(sequences[0]))
+    else:
+        rows = (list(values) for values in zip(*map(iterate, sequences)))
+    head = last = None
+    for args in rows:
+        cell = Pair(func(args), None)
+        if last is None:
+            head = cell
+        else:
+            last.cdr = cell
+        last = cell
+    return head
+
+
+def filter_values(func, sequence):
+    """
+    Shared body of the filter special form: a new Scheme list of the
+    elements of sequence for which func is true.
+    """
+    head = last = None
+    for value in iterate(sequence):
+        if func([value]):
+            cell = Pair(value, None)
+            if last is None:
+                head = cell
+            else:
+                last.cdr = cell
+            last = cell
+    return head
+
+
+def reduce_values(func, sequence, val):
+    """
+    Shared body of the reduce special form.
+    """
+    for value in iterate(sequence):
+        val = func([val, value])
+    return val
+
+
+def compile_map(tree, tail=False, scope=None):
+    function = compile_tree(tree[1], False, scope)
+    sequences = [compile_tree(tree[2], False, scope)]
+    sequences += [compile_tree(sequence, False, scope) for sequence in tree[3:]]
+
+    def map_(frame):
+        func = function(frame)
+        if not callable(func):
+            raise SchemeEvaluationError
+        return map_values(func, [sequence(frame) for sequence in sequences])
+
+    return map_
+
+
+def compile_filter(tree, tail=False, scope=None):
+    function = compile_tree(tree[1], False, scope)
+    sequence = compile_tree(tree[2], False, scope)
+
+    def filter_(frame):
+        func = function(frame)
+        if not callable(func):
+            raise SchemeEvaluationError
+        return filter_values(func, sequence(frame))
+
+    return filter_
+
+
+def compile_reduce(tree, tail=False, scope=None):
+    function = compile_tree(tree[1], False, scope)
+    sequence = compile_tree(tree[2], False, scope)
+    initial = compile_tree(tree[3], False, scope)
+
+    def reduce_(frame):
+        func = function(frame)
+        if not callable(func):
+            raise SchemeEvaluationError
+        list_ = sequence(frame)
+        return reduce_values(func, list_, initial(frame))
+
+    return reduce_
+
+
+def compile_del(tree, tail=False, scope=None):
+    name = tree[1]
+
+    if scope is None:
+
+        def del_(frame):
+            try:
+                val = frame.mappings[name]
+            except:
+                raise SchemeNameError
+            del frame[name]
+            return val
+
+        return del_
+
+    index = scope.index.get(name)
+    if index is None:
+        return raiser(SchemeNameError)
+
+    def del_local(frame):
+        val = frame.values[index]
+        if val is UNBOUND:
+            raise SchemeNameError
+        frame.values[index] = UNBOUND
+        return val
+
+    return del_local
+
+
+def compile_let(tree, tail=False, scope=None):
+    names = [var for var, _ in tree[1]]
+    values = [compile_tree(val, False, scope) for _, val in tree[1]]
+    (expression,) = tree[2:]
+    let_scope = Scope(names, expression, scope)
+    body = compile_tree(expression, tail, let_scope)
+    padding = let_scope.padding
+
+    def let(frame):
+        new_values = [val(frame) for val in values]
+        if padding:
+            new_values += padding
+        return body(LocalFrame(let_scope, frame, new_values))
+
+    return let
+
+
+def compile_set(tree, tail=False, scope=None):
+    name = tree[1]
+    value = compile_tree(tree[2], False, scope)
+    depth, index = (None, None) if scope is None else scope.resolve(name)
+
+    if index is None:
+
+        def set_(frame):
+            parent = frame
+            for _ in range(depth or 0):
+                parent = parent.parent
+            parent = parent.get_parent_from_key(name)
+            parent[name] = value(frame)
+            return parent[name]
+
+        return set_
+
+    def set_local(frame):
+        target = frame
+        for _ in range(depth):
+            target = target.parent
+        if target.values[index] is UNBOUND:
+            target = target.parent.get_parent_from_key(name)
+            target[name] = value(frame)
+            return target[name]
+        val = target.values[index] = value(frame)
+        return val
+
+    return set_local
+
+
+def compile_delay(tree, tail=False, scope=None):
+    (expression,) = tree[1:]
+    delayed = compile_tree(expression, False, scope)
+    return lambda frame: Promise(Delayed(delayed, expression, scope, frame))
+
+
+def compile_cons_stream(tree, tail=False, scope=None):
+    first, rest = tree[1:]
+    first = compile_tree(first, False, scope)
+    delayed = compile_tree(rest, False, scope)
+    return lambda frame: Pair(
+        first(frame), Promise(Delayed(delayed, rest, scope, frame))
+    )
+
+
+def compile_profile(tree, tail=False, scope=None):
+    (expression,) = tree[1:]
+    expression = compile_tree(expression, False, scope)
+    return lambda frame: profile_and_report(lambda: expression(frame))
+
+
+def compile_save_image(tree, tail=False, scope=None):
+    (path,) = tree[1:]
+    path = image_path(path)
+    return lambda frame: save_image_form([path, frame])
+
+
+special_forms = interned({
+    "define": compile_define,
+    "define-memo": compile_define_memo,
+    "lambda": compile_lambda,
+    "begin": compile_begin,
+    "and": compile_and,
+    "or": compile_or,
+    "if": compile_if,
+    "map": compile_map,
+    "filter": compile_filter,
+    "reduce": compile_reduce,
+    "del": compile_del,
+    "let": compile_let,
+    "set!": compile_set,
+    "delay": compile_delay,
+    "cons-stream": compile_cons_stream,
+    "profile": compile_profile,
+    "save-image": compile_save_image,
+})
+
+
+###############
+# Bytecode VM #
+###############
+
+# Each instruction is three ints in a Code's ops array: an opcode and two
+# arguments (unused ones are 0).  Jump targets are indices into ops.
+(
+    CONST,  # a: constant index
+    LOAD_LOCAL,  # a: depth, b: slot index
+    LOAD_GLOBAL,  # a: local frames to skip, b: name index
+    DEFINE_LOCAL,  # a: slot index
+    DEFINE_NAME,  # b: name index
+    FIND_LOCAL,  # a: depth, b: slot index (pushes the frame set! writes to)
+    FIND_NAME,  # a: local frames to skip, b: name index
+    STORE_FOUND,  # b: name index
+    DEL_LOCAL,  # a: slot index
+    DEL_NAME,  # b: name index
+    POP,
+    JUMP,  # a: target
+    JUMP_IF_FALSE,  # a: target
+    JUMP_IF_TRUE,  # a: target
+    TO_BOOL,
+    CHECK_CALLABLE,
+    CALL,  # a: argument count
+    TAIL_CALL,  # a: argument count, b: 1 to coerce the result to a boolean
+    RETURN,
+    MAKE_FUNCTION,  # a: constant index of the body's Code
+    ENTER_LET,  # a: variable count, b: constant index of the let's Scope
+    LEAVE_LET,
+    MAP,  # a: number of sequences
+    FILTER,
+    REDUCE,
+    RAISE,  # a: constant index of the exception class
+    DELAY,  # a: constant index of the delayed expression's Code
+    CONS_STREAM,  # a: constant index of the delayed rest's Code
+    LOAD_ENV,  # pushes the current frame
+    GUARD,  # a: constant index of a stamp, b: constant index of the fallback
+) = range(30)
+
+
+class Code:
+    """
+    Bytecode for a lambda body or a top-level expression: a flat array of
+    (opcode, a, b) triples plus the constant and name pools they index.
+    """
+
+    __slots__ = ("ops", "consts", "names", "scope", "args", "expression", "name")
+
+    def __init__(
+        self, ops, consts, names, scope, args, expression, name=None
+    ) -> None:
+        self.ops = array("i", ops)
+        self.consts = consts
+        self.names = names
+        self.scope = scope
+        self.args = args
+        self.expression = expression
+        self.name = name
+
+
+class VMFunction(Function):
+    """
+    A Function whose body is bytecode.  Calls between VMFunctions inside
+    run_code push a VM frame instead of recursing in Python.
+    """
+
+    def __init__(self, frame, expression, args, code) -> None:
+        self.args = args
+        self.expression = expression
+        self.frame = frame
+        self.scope = code.scope
+        self.code = code
+        self.name = code.name
+
+    def __call__(self, args):
+        if tracing:
+            return call_traced(self, args)
+        result = self.activate(args)
+        if type(result) is TailCall:
+            # only while profiling does run_code hand back tail calls
+            result = call_tail(result)
+        return result
+
+    def activate(self, args):
+        if len(args) != len(self.args):
+            raise SchemeEvaluationError
+        scope = self.scope
+        if scope.padding:
+            args = args + scope.padding
+        return run_code(self.code, LocalFrame(scope, self.frame, args))
+
+    def __setstate__(self, state):
+        # the bytecode is sent as it is; there is nothing to recompile
+        self.__dict__.update(state)
+
+
+class Assembler:
+    """
+    Accumulates the instructions and pools for one Code object.
+    """
+
+    def __init__(self) -> None:
+        self.ops = []
+        self.consts = []
+        self.names = []
+        self.name_index = {}
+
+    def emit(self, op, a=0, b=0):
+        self.ops += (op, a, b)
+        return len(self.ops) - 3
+
+    def patch(self, position, target):
+        self.ops[position + 1] = target
+
+    def here(self):
+        return len(self.ops)
+
+    def const(self, value):
+        for i, existing in enumerate(self.consts):
+            if existing is value:
+                return i
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def name(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def build(self, scope, args, expression, name=None):
+        return Code(self.ops, self.consts, self.names, scope, args, expression, name)
+
+
+def compile_code(tree, tail=False, scope=None):
+    """
+    Compile a parsed expression to bytecode for the VM engine, returning a
+    closure over a frame like compile_tree does.
+    """
+    asm = Assembler()
+    assemble(asm, tree, 0, scope)
+    asm.emit(RETURN)
+    code = asm.build(scope, [], tree)
+    return lambda frame: run_code(code, frame)
+
+
+def assemble(asm, tree, tail, scope):
+    """
+    Emit the instructions for tree.  tail is 0 outside tail position, 1 in
+    tail position, and 2 in the tail position of an and/or, whose value is
+    coerced to a boolean.
+    """
+    if isinstance(tree, str):
+        assemble_symbol(asm, tree, scope)
+    elif not isinstance(tree, FORM_TYPES):
+        asm.emit(CONST, asm.const(tree))
+    elif not tree:
+        asm.emit(RAISE, asm.const(SchemeEvaluationError))
+    elif isinstance(tree[0], str) and tree[0] in vm_special_forms:
+        start = asm.here()
+        try:
+            vm_special_forms[tree[0]](asm, tree, tail, scope)
+        except (IndexError, TypeError, ValueError):
+            del asm.ops[start:]
+            asm.emit(RAISE, asm.const(SchemeSyntaxError))
+    else:
+        assemble(asm, tree[0], 0, scope)
+        if isinstance(tree[0], (str, list, tuple)) or not callable(tree[0]):
+            asm.emit(CHECK_CALLABLE)
+        for arg in tree[1:]:
+            assemble(asm, arg, 0, scope)
+        if tail:
+            asm.emit(TAIL_CALL, len(tree) - 1, int(tail == 2))
+        else:
+            asm.emit(CALL, len(tree) - 1)
+
+
+def assemble_symbol(asm, name, scope):
+    if scope is None:
+        asm.emit(LOAD_GLOBAL, 0, asm.name(name))
+        return
+    depth, index = scope.resolve(name)
+    if index is None:
+        asm.emit(LOAD_GLOBAL, depth, asm.name(name))
+    else:
+        asm.emit(LOAD_LOCAL, depth, index)
+
+
+def assemble_define(asm, tree, tail, scope):
+    name = tree[1]
+    if isinstance(name, FORM_TYPES):
+        tree = ["define", name[0], ["lambda", name[1:], tree[2]]]
+        name = name[0]
+    assemble_value(asm, tree[2], scope, name)
+    assemble_binding(asm, name, scope)
+
+
+def assemble_define_memo(asm, tree, tail, scope):
+    name = tree[1]
+    if isinstance(name, FORM_TYPES):
+        tree = ["define", name[0], ["lambda", name[1:], tree[2]]]
+        name = name[0]
+    (value,) = tree[2:]
+    asm.emit(CONST, asm.const(memoize))
+    assemble_value(asm, value, scope, name)
+    asm.emit(CALL, 1)
+    assemble_binding(asm, name, scope)
+
+
+def assemble_value(asm, tree, scope, name):
+    if isinstance(tree, FORM_TYPES) and tree and tree[0] == "lambda":
+        assemble_lambda(asm, tree, 0, scope, name)
+    else:
+        assemble(asm, tree, 0, scope)
+
+
+def assemble_binding(asm, name, scope):
+    index = None if scope is None else scope.index.get(name)
+    if index is None:
+        asm.emit(DEFINE_NAME, 0, asm.name(name))
+    else:
+        asm.emit(DEFINE_LOCAL, index)
+
+
+def assemble_lambda(asm, tree, tail, scope, name=None):
+    args = tree[1]
+    expression = source = tree[2]
+    unoptimized = optimized_from(tree)
+    body = Assembler()
+    if unoptimized is not None:
+        source = unoptimized.expression
+        body.emit(GUARD, body.const(unoptimized))
+    label = function_label(name, args, source)
+    body_scope = Scope(args, source, scope, label)
+    body_scope.unoptimized = unoptimized
+    assemble(body, expression, 1, body_scope)
+    body.emit(RETURN)
+    code = body.build(body_scope, args, source, name)
+    asm.emit(MAKE_FUNCTION, asm.const(code))
+
+
+def assemble_begin(asm, tree, tail, scope):
+    if len(tree) < 2:
+        asm.emit(RAISE, asm.const(SchemeSyntaxError))
+        return
+    for expression in tree[1:-1]:
+        assemble(asm, expression, 0, scope)
+        asm.emit(POP)
+    assemble(asm, tree[-1], tail, scope)
+
+
+def assemble_and_or(asm, tree, tail, scope, short_circuit, jump):
+    if len(tree) < 2:
+        asm.emit(CONST, asm.const(not short_circuit))
+        return
+    jumps = []
+    for expression in tree[1:-1]:
+        assemble(asm, expression, 0, scope)
+        jumps.append(asm.emit(jump))
+    assemble(asm, tree[-1], 2 if tail else 0, scope)
+    asm.emit(TO_BOOL)
+    end = asm.emit(JUMP)
+    for position in jumps:
+        asm.patch(position, asm.here())
+    asm.emit(CONST, asm.const(short_circuit))
+    asm.patch(end, asm.here())
+
+
+def assemble_and(asm, tree, tail, scope):
+    assemble_and_or(asm, tree, tail, scope, False, JUMP_IF_FALSE)
+
+
+def assemble_or(asm, tree, tail, scope):
+    assemble_and_or(asm, tree, tail, scope, True, JUMP_IF_TRUE)
+
+
+def assemble_if(asm, tree, tail, scope):
+    pred, true_exp, false_exp = tree[1], tree[2], tree[3]
+    assemble(asm, pred, 0, scope)
+    to_false = asm.emit(JUMP_IF_FALSE)
+    assemble(asm, true_exp, tail, scope)
+    to_end = asm.emit(JUMP)
+    asm.patch(to_false, asm.here())
+    assemble(asm, false_exp, tail, scope)
+    asm.patch(to_end, asm.here())
+
+
+def assemble_map(asm, tree, tail, scope):
+    function, sequences = tree[1], [tree[2], *tree[3:]]
+    assemble(asm, function, 0, scope)
+    asm.emit(CHECK_CALLABLE)
+    for sequence in sequences:
+        assemble(asm, sequence, 0, scope)
+    asm.emit(MAP, len(sequences))
+
+
+def assemble_filter(asm, tree, tail, scope):
+    function, sequence = tree[1], tree[2]
+    assemble(asm, function, 0, scope)
+    asm.emit(CHECK_CALLABLE)
+    assemble(asm, sequence, 0, scope)
+    asm.emit(FILTER)
+
+
+def assemble_reduce(asm, tree, tail, scope):
+    function, sequence, initial = tree[1], tree[2], tree[3]
+    assemble(asm, function, 0, scope)
+    asm.emit(CHECK_CALLABLE)
+    assemble(asm, sequence, 0, scope)
+    assemble(asm, initial, 0, scope)
+    asm.emit(REDUCE)
+
+
+def assemble_del(asm, tree, tail, scope):
+    name = tree[1]
+    if scope is None:
+        asm.emit(DEL_NAME, 0, asm.name(name))
+        return
+    index = scope.index.get(name)
+    if index is None:
+        asm.emit(RAISE, asm.const(SchemeNameError))
+    else:
+        asm.emit(DEL_LOCAL, index)
+
+
+def assemble_let(asm, tree, tail, scope):
+    names = [var for var, _ in tree[1]]
+    (expression,) = tree[2:]
+    for _, val in tree[1]:
+        assemble(asm, val, 0, scope)
+    let_scope = Scope(names, expression, scope)
+    asm.emit(ENTER_LET, len(names), asm.const(let_scope))
+    assemble(asm, expression, tail, let_scope)
+    if not tail:
+        asm.emit(LEAVE_LET)
+
+
+def assemble_set(asm, tree, tail, scope):
+    name = tree[1]
+    value = tree[2]
+    depth, index = (0, None) if scope is None else scope.resolve(name)
+    if index is None:
+        asm.emit(FIND_NAME, depth, asm.name(name))
+    else:
+        asm.emit(FIND_LOCAL, depth, index)
+    assemble(asm, value, 0, scope)
+    asm.emit(STORE_FOUND, 0, asm.name(name))
+
+
+def assemble_delayed(expression, scope):
+    # compiled in the enclosing scope: the promise runs it in the same frame
+    delayed = Assembler()
+    assemble(delayed, expression, 0, scope)
+    delayed.emit(RETURN)
+    return delayed.build(scope, [], expression)
+
+
+def assemble_body(expression, scope):
+    # a lambda body as written, for a GUARD whose optimized code is stale
+    body = Assembler()
+    assemble(body, expression, 1, scope)
+    body.emit(RETURN)
+    return body.build(scope, [], expression)
+
+
+def assemble_delay(asm, tree, tail, scope):
+    (expression,) = tree[1:]
+    asm.emit(DELAY, asm.const(assemble_delayed(expression, scope)))
+
+
+def assemble_cons_stream(asm, tree, tail, scope):
+    first, rest = tree[1:]
+    assemble(asm, first, 0, scope)
+    asm.emit(CONS_STREAM, asm.const(assemble_delayed(rest, scope)))
+
+
+def assemble_profile(asm, tree, tail, scope):
+    (expression,) = tree[1:]
+    asm.emit(CONST, asm.const(profile_promise))
+    asm.emit(DELAY, asm.const(assemble_delayed(expression, scope)))
+    asm.emit(CALL, 1)
+
+
+def assemble_save_image(asm, tree, tail, scope):
+    (path,) = tree[1:]
+    asm.emit(CONST, asm.const(save_image_form))
+    asm.emit(CONST, asm.const(image_path(path)))
+    asm.emit(LOAD_ENV)
+    asm.emit(CALL, 2)
+
+
+vm_special_forms = interned({
+    "define": assemble_define,
+    "define-memo": assemble_define_memo,
+    "lambda": assemble_lambda,
+    "begin": assemble_begin,
+    "and": assemble_and,
+    "or": assemble_or,
+    "if": assemble_if,
+    "map": assemble_map,
+    "filter": assemble_filter,
+    "reduce": assemble_reduce,
+    "del": assemble_del,
+    "let": assemble_let,
+    "set!": assemble_set,
+    "delay": assemble_delay,
+    "cons-stream": assemble_cons_stream,
+    "profile": assemble_profile,
+    "save-image": assemble_save_image,
+})
+
+
+def run_code(code, env):
+    """
+    Run code in env with a single dispatch loop.  Calls from one VMFunction
+    to another save the caller's registers on an explicit call stack, so
+    Scheme recursion does not grow the Python stack.
+    """
+    ops = code.ops
+    consts = code.consts
+    names = code.names
+    pc = 0
+    coerce = False
+    stack = []
+    calls = []
+    while True:
+        op = ops[pc]
+        a = ops[pc + 1]
+        b = ops[pc + 2]
+        pc += 3
+        if op == LOAD_LOCAL:
+            frame = env
+            for _ in range(a):
+                frame = frame.parent
+            val = frame.values[b]
+            if val is UNBOUND:
+                val = frame.parent[frame.scope.names[b]]
+            stack.append(val)
+        elif op == LOAD_GLOBAL:
+            frame = env
+            for _ in range(a):
+                frame = frame.parent
+            stack.append(frame[names[b]])
+        elif op == CONST:
+            stack.append(consts[a])
+        elif op == CHECK_CALLABLE:
+            if not callable(stack[-1]):
+                raise SchemeEvaluationError
+        elif op == CALL or op == TAIL_CALL:
+            if a:
+                args = stack[-a:]
+                del stack[-a:]
+            else:
+                args = []
+            func = stack.pop()
+            if op == TAIL_CALL and b:
+                coerce = True
+            if type(func) is VMFunction and not tracing:
+                if len(args) != len(func.args):
+                    raise SchemeEvaluationError
+                scope = func.scope
+                if scope.padding:
+                    args = args + scope.padding
+                if op == CALL:
+                    calls.append((ops, consts, names, pc, env, coerce))
+                    coerce = False
+                new_code = func.code
+                ops = new_code.ops
+                consts = new_code.consts
+                names = new_code.names
+                env = LocalFrame(scope, func.frame, args)
+                pc = 0
+            elif op == CALL:
+                if tracing:
+                    stack.append(call_traced(func, args))
+                else:
+                    stack.append(func(args))
+            elif tracing and not calls and isinstance(func, Function):
+                # hand the tail call to call_traced, which accounts for each
+                # function separately
+                tail_call = TailCall(func, args)
+                tail_call.coerce = coerce
+                return tail_call
+            else:
+                val = call_traced(func, args) if tracing else func(args)
+                if coerce:
+                    val = bool(val)
+                if not calls:
+                    return val
+                ops, consts, names, pc, env, coerce = calls.pop()
+                stack.append(val)
+        elif op == JUMP_IF_FALSE:
+            if not stack.pop():
+                pc = a
+        elif op == RETURN:
+            val = stack.pop()
+            if coerce:
+                val = bool(val)
+            if not calls:
+                return val
+            ops, consts, names, pc, env, coerce = calls.pop()
+            stack.append(val)
+        elif op == JUMP:
+            pc = a
+        elif op == GUARD:
+            if consts[a].stale or profiler is not None:
+                fallback = consts[a].fallback_code(env.scope)
+                ops = fallback.ops
+                consts = fallback.consts
+                names = fallback.names
+                pc = 0
+        elif op == JUMP_IF_TRUE:
+            if stack.pop():
+                pc = a
+        elif op == TO_BOOL:
+            stack[-1] = bool(stack[-1])
+        elif op == POP:
+            stack.pop()
+        elif op == MAKE_FUNCTION:
+            body = consts[a]
+            stack.append(VMFunction(env, body.expression, body.args, body))
+        elif op == ENTER_LET:
+            if a:
+                values = stack[-a:]
+                del stack[-a:]
+            else:
+                values = []
+            scope = consts[b]
+            if scope.padding:
+                values += scope.padding
+            env = LocalFrame(scope, env, values)
+        elif op == LEAVE_LET:
+            env = env.parent
+        elif op == DEFINE_LOCAL:
+            env.values[a] = stack[-1]
+        elif op == DEFINE_NAME:
+            env[names[b]] = stack[-1]
+        elif op == FIND_LOCAL:
+            frame = env
+            for _ in range(a):
+                frame = frame.parent
+            if frame.values[b] is UNBOUND:
+                frame = frame.parent.get_parent_from_key(frame.scope.names[b])
+            stack.append(frame)
+        elif op == FIND_NAME:
+            frame = env
+            for _ in range(a):
+                frame = frame.parent
+            stack.append(frame.get_parent_from_key(names[b]))
+        elif op == STORE_FOUND:
+            val = stack.pop()
+            target = stack.pop()
+            target[names[b]] = val
+            stack.append(target[names[b]])
+        elif op == DEL_LOCAL:
+            val = env.values[a]
+            if val is UNBOUND:
+                raise SchemeNameError
+            env.values[a] = UNBOUND
+            stack.append(val)
+        elif op == DEL_NAME:
+            try:
+                val = env.mappings[names[b]]
+            except:
+                raise SchemeNameError
+            del env[names[b]]
+            stack.append(val)
+        elif op == MAP:
+            sequences = stack[-a:]
+            del stack[-a:]
+            func = stack.pop()
+            stack.append(map_values(func, sequences))
+        elif op == FILTER:
+            sequence = stack.pop()
+            func = stack.pop()
+            stack.append(filter_values(func, sequence))
+        elif op == REDUCE:
+            val = stack.pop()
+            list_ = stack.pop()
+            func = stack.pop()
+            stack.append(reduce_values(func, list_, val))
+        elif op == DELAY:
+            stack.append(Promise(DelayedCall(run_delayed, (consts[a], env))))
+        elif op == CONS_STREAM:
+            stack[-1] = Pair(
+                stack[-1], Promise(DelayedCall(run_delayed, (consts[a], env)))
+            )
+        elif op == RAISE:
+            raise consts[a]
+        elif op == LOAD_ENV:
+            stack.append(env)
+        else:
+            raise SchemeEvaluationError
+
+
+def run_delayed(args):
+    # the thunk of a promise made by DELAY or CONS_STREAM
+    code, env = args
+    return run_code(code, env)
+
+
+#############
+# Optimizer #
+#############
+
+# builtins the optimizer may run at compile time when every argument is a
+# constant, and builtin names it may replace by their values
+pure_builtins = {"+", "-", "*", "/", "equal?", ">", ">=", "<", "<=", "not"}
+constant_builtins = {"#t", "#f", "nil"}
+
+# forms that bind or rebind names; bodies containing them are never inlined
+binding_forms = {"define", "define-memo", "lambda", "let", "set!", "del"}
+
+# a user function is inlined if its body has at most this many nodes, and
+# inlined bodies are themselves inlined into at most this many levels deep
+INLINE_SIZE = 16
+INLINE_DEPTH = 3
+
+optimizer_enabled = True
+
+class Rebinds:
+    """
+    The optimized lambda bodies of one global frame (and its builtins) that
+    depend on each global name, i.e. call or fold it as a builtin or inline
+    it as a function.  Defining, set!ing or deleting the name makes them
+    stale.
+    """
+
+    __slots__ = ("dependents",)
+
+    def __init__(self) -> None:
+        self.dependents = {}
+
+    def depend(self, unoptimized, names):
+        # keyed by id, as an Unoptimized compares by value; dead lambdas drop out
+        for name in names:
+            dependents = self.dependents.setdefault(name, weakref.WeakValueDictionary())
+            dependents[id(unoptimized)] = unoptimized
+
+    def rebind(self, name):
+        for unoptimized in self.dependents.pop(name).values():
+            unoptimized.stale = True
+
+    def __reduce__(self):
+        # each Unoptimized that is still current adds itself back when loaded
+        return (Rebinds, ())
+
+
+class Unoptimized:
+    """
+    Fourth element of a lambda the optimizer rewrote: the body as written,
+    and the global names the rewrite depends on.  The compiled lambda runs
+    the optimized body until rebinds marks it stale.
+    """
+
+    __slots__ = (
+        "expression",
+        "rebinds",
+        "depends",
+        "stale",
+        "body",
+        "code",
+        "__weakref__",
+    )
+
+    def __init__(self, expression, rebinds, depends) -> None:
+        self.expression = expression
+        self.rebinds = rebinds
+        self.depends = frozenset(depends)
+        self.stale = False
+        self.body = self.code = None
+        rebinds.depend(self, self.depends)
+
+    def fallback(self, scope):
+        # the closure engine's body as written, compiled once it is needed
+        if self.body is None:
+            self.body = compile_tree(self.expression, True, scope)
+        return self.body
+
+    def fallback_code(self, scope):
+        # the same for the VM
+        if self.code is None:
+            self.code = assemble_body(self.expression, scope)
+        return self.code
+
+    def __getstate__(self):
+        return (self.expression, self.rebinds, self.depends, self.stale)
+
+    def __setstate__(self, state):
+        self.expression, self.rebinds, self.depends, self.stale = state
+        self.body = self.code = None
+        if not self.stale:
+            self.rebinds.depend(self, self.depends)
+
+    def __eq__(self, other):
+        return (
+            type(other) is Unoptimized
+            and self.expression == other.expression
+            and self.depends == other.depends
+        )
+
+
+def optimized_from(tree):
+    # the Unoptimized of a lambda form, or None if it was not rewritten
+    if len(tree) > 3 and type(tree[3]) is Unoptimized:
+        return tree[3]
+    return None
+
+
+def set_optimizer(enabled):
+    """
+    Turn the optimizing pass that evaluate runs before compiling on or off.
+    """
+    global optimizer_enabled
+    optimizer_enabled = bool(enabled)
+
+
+def optimize(tree, frame):
+    """
+    Simplify a parsed expression that is about to be evaluated in the global
+    frame: fold calls to arithmetic and comparison builtins whose arguments
+    are constants, drop if branches whose predicate is a constant, replace
+    builtin names (and #t, #f, nil) by their values, and inline calls to
+    small non-recursive functions defined in frame.
+
+    A name is only treated as the builtin (or the function) it currently
+    refers to if the expression never defines, set!s or deletes it and no
+    enclosing lambda or let binds it.  Anything that could raise is left to
+    raise when it is evaluated.  Code that outlives this evaluation (lambda
+    bodies) may also see later forms rebind those names, so a rewritten
+    lambda carries its body as written (see Unoptimized) and switches to it
+    once any name it depends on is rebound in frame; delayed expressions are
+    left as written.  The result is built from tuples if tree is, and from
+    lists otherwise.
+    """
+    if frame.scope is not None or frame.rebinds is None:
+        return tree
+    form = tuple if isinstance(tree, tuple) else list
+    return Optimizer(frame, assigned_names(tree), form).visit(tree)
+
+
+def assigned_names(tree):
+    """
+    Every name that tree (including nested lambdas) defines, set!s or deletes.
+    """
+    names = set()
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if not isinstance(tree, FORM_TYPES) or not tree:
+            continue
+        head = tree[0]
+        if head in ("define", "define-memo", "set!", "del") and len(tree) > 1:
+            name = tree[1]
+            if isinstance(name, FORM_TYPES):
+                if name and isinstance(name[0], str):
+                    names.add(name[0])
+            elif isinstance(name, str):
+                names.add(name)
+        stack.extend(tree)
+    return names
+
+
+def is_constant(tree):
+    return not isinstance(tree, (str, list, tuple))
+
+
+def tree_size(tree):
+    if not isinstance(tree, FORM_TYPES):
+        return 1
+    return 1 + sum(tree_size(subtree) for subtree in tree)
+
+
+def tree_names(tree):
+    if isinstance(tree, str):
+        yield tree
+    elif isinstance(tree, FORM_TYPES):
+        for subtree in tree:
+            yield from tree_names(subtree)
+
+
+def substitute(tree, values):
+    if isinstance(tree, str):
+        return values.get(tree, tree)
+    if isinstance(tree, FORM_TYPES):
+        return type(tree)(substitute(subtree, values) for subtree in tree)
+    return tree
+
+
+class Optimizer:
+    """
+    One optimizing pass over a tree.  Each visit method takes the names bound
+    by the enclosing lambdas, lets and internal defines (bound) and the
+    subset of them that always hold a value (params: lambda parameters and
+    let variables, which are safe to copy into an inlined body).  New
+    expressions are built with form (list or tuple) from a list.  depends
+    collects the global names the innermost lambda being visited relies on.
+    """
+
+    def __init__(self, frame, assigned, form=list) -> None:
+        self.frame = frame
+        self.assigned = assigned
+        self.form = form
+        self.depends = set()
+        self.forms = {
+            "if": self.visit_if,
+            "begin": self.visit_begin,
+            "lambda": self.visit_lambda,
+            "let": self.visit_let,
+            "define": self.visit_define,
+            "define-memo": self.visit_define,
+            "set!": self.visit_set,
+            "del": lambda tree, bound, params, depth: tree,
+            "delay": lambda tree, bound, params, depth: tree,
+            # profiled code runs as written, so every call in it shows up
+            "profile": lambda tree, bound, params, depth: tree,
+            "cons-stream": self.visit_cons_stream,
+        }
+
+    def global_value(self, name, bound):
+        # the value name refers to, if that can't change under this tree
+        if name in bound or name in self.assigned:
+            return UNBOUND
+        try:
+            return self.frame.get_parent_from_key(name).mappings[name]
+        except SchemeNameError:
+            return UNBOUND
+
+    def builtin(self, name, bound):
+        value = self.global_value(name, bound)
+        if name in scheme_builtins and value is scheme_builtins[name]:
+            self.depends.add(name)
+            return value
+        return UNBOUND
+
+    def visit(self, tree, bound=frozenset(), params=frozenset(), depth=0):
+        if isinstance(tree, str):
+            if tree in constant_builtins:
+                value = self.builtin(tree, bound)
+                if value is not UNBOUND:
+                    return value
+            return tree
+        if not isinstance(tree, FORM_TYPES) or not tree:
+            return tree
+        head = tree[0]
+        if isinstance(head, str) and head in special_forms:
+            form = self.forms.get(head)
+            try:
+                if form is not None:
+                    return form(tree, bound, params, depth)
+                return self.form(
+                    [head]
+                    + [
+                        self.visit(subtree, bound, params, depth)
+                        for subtree in tree[1:]
+                    ]
+                )
+            except (IndexError, TypeError, ValueError):
+                # malformed: leave it to raise SchemeSyntaxError when evaluated
+                return tree
+        args = [self.visit(arg, bound, params, depth) for arg in tree[1:]]
+        if isinstance(head, str):
+            inlined = self.inline(head, args, bound, params, depth)
+            if inlined is not None:
+                self.depends.add(head)
+                return inlined
+            func = self.builtin(head, bound)
+        elif is_constant(head):
+            # a builtin already put in place, e.g. in an inlined body
+            func = head
+        else:
+            return self.form([self.visit(head, bound, params, depth)] + args)
+        if func is UNBOUND or not callable(func):
+            return self.form([head] + args)
+        if any(func is scheme_builtins[name] for name in pure_builtins):
+            if all(map(is_constant, args)):
+                try:
+                    value = func(args)
+                except Exception:
+                    value = None
+                if type(value) in (int, float, bool):
+                    return value
+        return self.form([func] + args)
+
+    def inline(self, name, args, bound, params, depth):
+        """
+        The body of the function name refers to with args substituted for
+        its parameters, or None if the call can't be inlined safely.
+        """
+        if depth >= INLINE_DEPTH or profiler is not None:
+            # code compiled while profiling keeps its calls, so they show up
+            return None
+        func = self.global_value(name, bound)
+        if type(func) not in (Function, VMFunction) or func.frame is not self.frame:
+            return None
+        names = func.args
+        body = func.expression
+        if (
+            len(args) != len(names)
+            or len(set(names)) != len(names)
+            or not all(
+                isinstance(arg, str) and arg not in special_forms for arg in names
+            )
+            or tree_size(body) > INLINE_SIZE
+        ):
+            return None
+        for arg in args:
+            # constants and parameters can be copied without changing when
+            # (or whether) they are evaluated
+            if is_constant(arg):
+                continue
+            if not isinstance(arg, str) or arg not in params or arg in self.assigned:
+                return None
+        for symbol in tree_names(body):
+            if symbol == name or symbol in binding_forms:
+                return None
+            if symbol not in names and symbol in bound:
+                return None
+        body = substitute(body, dict(zip(names, args)))
+        return self.visit(body, bound, params, depth + 1)
+
+    def visit_if(self, tree, bound, params, depth):
+        _, predicate, true_exp, false_exp = tree
+        predicate = self.visit(predicate, bound, params, depth)
+        if is_constant(predicate):
+            branch = true_exp if predicate else false_exp
+            return self.visit(branch, bound, params, depth)
+        return self.form(
+            [
+                "if",
+                predicate,
+                self.visit(true_exp, bound, params, depth),
+                self.visit(false_exp, bound, params, depth),
+            ]
+        )
+
+    def visit_begin(self, tree, bound, params, depth):
+        if len(tree) < 2:
+            return tree
+        expressions = [
+            self.visit(expression, bound, params, depth) for expression in tree[1:]
+        ]
+        # constants before the last expression have no effect
+        expressions = [
+            e for e in expressions[:-1] if not is_constant(e)
+        ] + expressions[-1:]
+        if len(expressions) == 1:
+            return expressions[0]
+        return self.form(["begin"] + expressions)
+
+    def visit_body(self, names, body, bound, params, depth):
+        defined = set(find_defines(body))
+        bound = bound | set(names) | defined
+        params = (params - defined) | set(names)
+        return self.visit(body, bound, params, depth)
+
+    def visit_lambda(self, tree, bound, params, depth):
+        _, names, body = tree
+        if not all(isinstance(name, str) for name in names):
+            return tree
+        outer = self.depends
+        self.depends = set()
+        try:
+            optimized = self.visit_body(names, body, bound, params, depth)
+            depends = self.depends
+        finally:
+            self.depends = outer
+        if not depends:
+            return self.form(["lambda", names, optimized])
+        unoptimized = Unoptimized(body, self.frame.rebinds, depends)
+        return self.form(["lambda", names, optimized, unoptimized])
+
+    def visit_let(self, tree, bound, params, depth):
+        _, bindings, body = tree
+        names = [var for var, _ in bindings]
+        if not all(isinstance(name, str) for name in names):
+            return tree
+        values = [self.visit(value, bound, params, depth) for _, value in bindings]
+        bindings = self.form(
+            self.form([name, value]) for name, value in zip(names, values)
+        )
+        return self.form(
+            ["let", bindings, self.visit_body(names, body, bound, params, depth)]
+        )
+
+    def visit_define(self, tree, bound, params, depth):
+        head, name, value = tree
+        if isinstance(name, FORM_TYPES):
+            name, value = name[0], self.form(["lambda", name[1:], value])
+        return self.form([head, name, self.visit(value, bound, params, depth)])
+
+    def visit_cons_stream(self, tree, bound, params, depth):
+        # the rest is delayed, like the expression of delay
+        head, first, rest = tree
+        return self.form([head, self.visit(first, bound, params, depth), rest])
+
+    def visit_set(self, tree, bound, params, depth):
+        _, name, value = tree
+        return self.form(["set!", name, self.visit(value, bound, params, depth)])
+
+
+################
+# Traced Calls #
+################
+
+# set while a Profiler or a Budget is installed or a green thread is running;
+# every call site checks only this, so untraced programs pay one test per call
+tracing = False
+
+
+def update_tracing():
+    global tracing
+    tracing = profiler is not None or budget is not None or green_thread is not None
+
+
+def call_traced(func, args):
+    """
+    Call func (a Function or a builtin) for args, charging each function
+    body it runs, including the ones it tail-calls, to the installed Budget
+    and Profiler, and to the running green thread's time slice.
+    """
+    coerce = False
+    while isinstance(func, Function):
+        if green_thread is not None:
+            green_thread.tick()
+        if budget is not None:
+            budget.enter()
+        if profiler is not None:
+            profiler.enter(func.scope.function)
+        try:
+            result = func.activate(args)
+        finally:
+            if profiler is not None:
+                profiler.exit()
+            if budget is not None:
+                budget.depth -= 1
+        if type(result) is not TailCall:
+            break
+        func = result.func
+        args = result.args
+        coerce = coerce or result.coerce
+    else:
+        if budget is not None:
+            budget.step()
+        if profiler is not None:
+            result = profiler.call_builtin(func, args)
+        else:
+            result = func(args)
+    if coerce:
+        return bool(result)
+    return result
+
+
+def call_tail(tail_call):
+    result = tail_call.func(tail_call.args)
+    if tail_call.coerce:
+        return bool(result)
+    return result
+
+
+############
+# Profiler #
+############
+
+# the Profiler recording calls, if any
+profiler = None
+# the Profiler of the last profiled run, for inspecting or exporting it
+last_profile = None
+
+
+class Profiler:
+    """
+    Call counts, self time and cumulative time for each Scheme function (by
+    the name it was defined under) and builtin called while it is installed.
+
+    Self time excludes the time spent in the functions a call made;
+    cumulative time includes it, counting recursive calls only once.  A call
+    in tail position replaces its caller, so it is timed on its own.
+    """
+
+    def __init__(self) -> None:
+        # name -> [calls, self time, cumulative time]
+        self.stats = {}
+        # [name, start time, time spent in callees] for each running call
+        self.stack = []
+        # name -> number of its calls currently running
+        self.running = {}
+        self.builtin_names = {
+            value: name for name, value in scheme_builtins.items() if callable(value)
+        }
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+        self.running[name] = self.running.get(name, 0) + 1
+
+    def exit(self):
+        name, start, callees = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        record = self.stats.setdefault(name, [0, 0.0, 0.0])
+        record[0] += 1
+        record[1] += elapsed - callees
+        self.running[name] -= 1
+        if not self.running[name]:
+            record[2] += elapsed
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def call_builtin(self, func, args):
+        self.enter(self.label(func))
+        try:
+            return func(args)
+        finally:
+            self.exit()
+
+    def label(self, func):
+        if isinstance(func, Function):
+            return func.scope.function
+        if isinstance(func, MemoizedFunction):
+            return "memoized " + self.label(func.func)
+        return self.builtin_names.get(func, repr(func))
+
+    def rows(self):
+        """
+        One dict per function, most cumulative time first.
+        """
+        rows = [
+            {"function": name, "calls": calls, "self": self_, "cumulative": total}
+            for name, (calls, self_, total) in self.stats.items()
+        ]
+        rows.sort(key=lambda row: (-row["cumulative"], -row["self"], row["function"]))
+        return rows
+
+    def report(self):
+        lines = [f"{'calls':>8} {'self (s)':>10} {'cumulative (s)':>14}  function"]
+        for row in self.rows():
+            lines.append(
+                f"{row['calls']:>8} {row['self']:>10.6f} {row['cumulative']:>14.6f}"
+                f"  {row['function']}"
+            )
+        return "\n".join(lines)
+
+    def to_json(self):
+        return json.dumps(self.rows(), indent=2)
+
+
+def function_label(name, args, expression):
+    if name is not None:
+        return name
+    return source_text(["lambda", args, expression])
+
+
+def source_text(tree, limit=40):
+    """
+    The Scheme source for a parsed expression, cut short after limit
+    characters.
+    """
+    if isinstance(tree, FORM_TYPES):
+        text = "(" + " ".join(source_text(subtree, None) for subtree in tree) + ")"
+    elif callable(tree):
+        # a builtin the optimizer put in place of its name
+        names = [name for name, value in scheme_builtins.items() if value is tree]
+        text = names[0] if names else repr(tree)
+    elif tree is None:
+        text = "nil"
+    elif tree is True or tree is False:
+        text = "#t" if tree else "#f"
+    else:
+        text = str(tree)
+    if limit is not None and len(text) > limit:
+        text = text[: limit - 4] + " ..."
+    return text
+
+
+def run_profiled(thunk):
+    """
+    Return thunk() run with a new Profiler installed (afterwards available
+    as last_profile).  Inside a run that is already being profiled, thunk
+    is simply part of that run.
+    """
+    global profiler, last_profile
+    if profiler is not None:
+        return thunk()
+    profiler = Profiler()
+    update_tracing()
+    try:
+        return thunk()
+    finally:
+        last_profile, profiler = profiler, None
+        update_tracing()
+
+
+def profile_and_report(thunk):
+    # the body of the profile form: print the report once the outermost
+    # profiled expression has finished
+    outermost = profiler is None
+    result = run_profiled(thunk)
+    if outermost:
+        print(last_profile.report())
+    return result
+
+
+def profile_promise(args):
+    (promise,) = args
+    return profile_and_report(promise.force)
+
+
+class Sampler:
+    """
+    A sampling profiler: while running, a background thread looks at the
+    Python stack of the thread that started it every interval seconds and
+    counts the chain of Scheme functions being called (outermost first).
+    The interpreter itself does no extra work, so programs run at close to
+    full speed.
+
+    collapsed() gives the counts in the collapsed-stack format read by
+    flame graph tools: one "outer;inner;innermost count" line per stack.
+
+    Use it as a context manager around the code to sample.
+    """
+
+    def __init__(self, interval=0.001) -> None:
+        self.interval = interval
+        # tuple of function labels -> number of samples
+        self.counts = {}
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        target = threading.get_ident()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(target,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self, target):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                return
+            stack = tuple(scheme_stack(frame)) or ("<toplevel>",)
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+            del frame
+
+    def collapsed(self):
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in sorted(self.counts.items())
+        )
+
+    def write(self, path):
+        with open(path, mode="w") as file:
+            file.write(self.collapsed())
+
+
+def scheme_stack(frame):
+    """
+    The labels of the Scheme functions running in a Python stack, from the
+    outermost call to frame's.
+    """
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        if code is Function.__call__.__code__ or code is call_traced.__code__:
+            func = frame.f_locals.get("func")
+            # VMFunctions are found from run_code, which runs their bodies
+            if type(func) is Function:
+                labels.append(func.scope.function)
+        elif code is run_code.__code__:
+            f_locals = frame.f_locals
+            envs = [call[4] for call in f_locals.get("calls", ())]
+            envs.append(f_locals.get("env"))
+            for env in reversed(envs):
+                label = frame_function(env)
+                if label is not None:
+                    labels.append(label)
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def frame_function(env):
+    # the function whose call created env (or the let frames inside it)
+    while isinstance(env, LocalFrame):
+        if env.scope.function is not None:
+            return env.scope.function
+        env = env.parent
+    return None
+
+
+###########
+# Budgets #
+###########
+
+# the Budget of the evaluation running now, if any
+budget = None
+
+
+class Budget:
+    """
+    Limits for evaluate and result_and_frame: at most steps calls (to
+    functions, including tail calls, and to builtins), seconds of wall-clock
+    time, depth nested function calls, and allocations new Pairs and local
+    frames.  A limit left as None is not enforced.  Going over any of them
+    raises SchemeBudgetError.  Budgeted programs are not trusted to write
+    files, so save-image only writes inside the directory images, and not
+    at all when that is "" (the default).
+
+    The counts and the deadline (set by the first evaluation that uses the
+    budget) carry over between evaluations given the same Budget.
+    """
+
+    def __init__(
+        self, steps=None, seconds=None, depth=None, allocations=None, images=""
+    ) -> None:
+        self.max_steps = steps
+        self.seconds = seconds
+        self.max_depth = depth
+        self.max_allocations = allocations
+        self.images = images
+        self.steps = 0
+        self.depth = 0
+        self.allocations = 0
+        self.deadline = None
+
+    def start(self):
+        if self.deadline is None and self.seconds is not None:
+            self.deadline = time.monotonic() + self.seconds
+
+    def step(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise SchemeBudgetError("step limit exceeded")
+        # reading the clock costs more than the rest; do it every 256 steps
+        if not self.steps & 0xFF:
+            self.check_deadline()
+
+    def enter(self):
+        self.step()
+        self.depth += 1
+        if self.max_depth is not None and self.depth > self.max_depth:
+            self.depth -= 1
+            raise SchemeBudgetError("call depth limit exceeded")
+
+    def allocate(self):
+        self.allocations += 1
+        if self.max_allocations is not None and self.allocations > self.max_allocations:
+            raise SchemeBudgetError("allocation limit exceeded")
+        if not self.allocations & 0xFFF:
+            self.check_deadline()
+
+    def check_deadline(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise SchemeBudgetError("time limit exceeded")
+
+
+def run_budgeted(new_budget, thunk):
+    """
+    Return thunk() run with new_budget installed.  Running out of Python
+    stack is reported as going over the budget too.
+    """
+    global budget
+    previous = budget
+    budget = new_budget
+    update_tracing()
+    new_budget.start()
+    try:
+        return thunk()
+    except RecursionError:
+        raise SchemeBudgetError("recursion limit exceeded") from None
+    finally:
+        budget = previous
+        update_tracing()
+
+
+#################
+# Green Threads #
+#################
+
+# the green thread running now, if any; only one runs at a time
+green_thread = None
+# function calls a green thread may make before it is switched out
+SLICE_STEPS = 1000
+# units of builtin work (pairs built, sort comparisons) that count as a call
+WORK_STEPS = 16
+# held while a green thread runs, so schedulers on different event loop
+# tasks still run their threads one at a time
+switch_lock = threading.Lock()
+
+
+class GreenExit(BaseException):
+    # unwinds a green thread that is abandoned (e.g. when the main one ends)
+    pass
+
+
+class GreenThread:
+    """
+    A Scheme procedure call run by a Scheduler.  The evaluators recurse in
+    Python, so each green thread runs on its own OS thread, but they hand
+    off strictly: exactly one runs at a time (with the scheduler's thread
+    waiting), and it suspends only at yield, sleep and blocking channel
+    operations, or once it has used up its time slice.  Builtins that loop
+    without calling a Scheme function count their work toward the slice, so
+    e.g. (range 2000000) is preempted too.
+    """
+
+    def __init__(self, scheduler, func, args) -> None:
+        self.scheduler = scheduler
+        self.func = func
+        self.args = args
+        self.thread = None
+        self.resume = threading.Semaphore(0)
+        self.reply = None
+        self.steps = 0
+        self.work_done = 0
+        self.done = False
+        self.killed = False
+        self.value = None
+        self.error = None
+
+    def __str__(self):
+        return "#<thread>"
+
+    def run(self):
+        self.resume.acquire()
+        try:
+            if not self.killed:
+                self.value = self.func(self.args)
+        except GreenExit:
+            pass
+        except Exception as error:
+            self.error = error
+        self.done = True
+        self.scheduler.request = ("done",)
+        self.scheduler.suspended.release()
+
+    def stopped(self):
+        return self.done or self.killed
+
+    def tick(self):
+        self.steps += 1
+        if self.steps >= self.scheduler.slice_steps:
+            self.suspend(("yield",))
+
+    def work(self):
+        self.work_done += 1
+        if self.work_done >= WORK_STEPS:
+            self.work_done = 0
+            self.tick()
+
+    def suspend(self, request):
+        """
+        Hand request (what this thread waits for) to the scheduler and wait
+        until it resumes this thread, returning the value it passes back.
+        """
+        if self.killed:
+            raise GreenExit
+        self.steps = 0
+        self.scheduler.request = request
+        self.scheduler.suspended.release()
+        self.resume.acquire()
+        if self.killed:
+            raise GreenExit
+        reply, self.reply = self.reply, None
+        return reply
+
+
+class Channel:
+    """
+    A queue of values between green threads.  channel-get waits while it is
+    empty, and channel-put while it holds capacity values (if given).
+    """
+
+    __slots__ = ("items", "capacity", "getters", "putters")
+
+    def __init__(self, capacity=None) -> None:
+        self.items = deque()
+        self.capacity = capacity
+        # green threads waiting to get, and (thread, value) waiting to put
+        self.getters = deque()
+        self.putters = deque()
+
+    def __str__(self):
+        return "#<channel>"
+
+    def prune(self):
+        # drop waiters that were stopped (their scheduler ended) meanwhile
+        while self.getters and self.getters[0].stopped():
+            self.getters.popleft()
+        while self.putters and self.putters[0][0].stopped():
+            self.putters.popleft()
+
+    def forget(self, threads):
+        # remove threads of a finished scheduler from both queues
+        self.getters = deque(thread for thread in self.getters if thread not in threads)
+        self.putters = deque(entry for entry in self.putters if entry[0] not in threads)
+
+    def put(self, value):
+        self.prune()
+        if self.getters:
+            thread = self.getters.popleft()
+            thread.scheduler.ready.append((thread, value))
+        elif self.capacity is None or len(self.items) < self.capacity:
+            self.items.append(value)
+        elif green_thread is None:
+            raise SchemeEvaluationError("channel-put would wait forever")
+        else:
+            green_thread.suspend(("put", self, value))
+
+    def get(self):
+        self.prune()
+        if self.items:
+            value = self.items.popleft()
+            self.prune()
+            if self.putters:
+                thread, waiting = self.putters.popleft()
+                self.items.append(waiting)
+                thread.scheduler.ready.append((thread, None))
+            return value
+        if self.putters:
+            thread, value = self.putters.popleft()
+            thread.scheduler.ready.append((thread, None))
+            return value
+        if green_thread is None:
+            raise SchemeEvaluationError("channel-get would wait forever")
+        return green_thread.suspend(("get", self))
+
+
+class Scheduler:
+    """
+    Runs green threads one at a time, round robin, as a coroutine on an
+    asyncio event loop.  Each time slice runs in the loop's default executor,
+    so the loop's other tasks keep running meanwhile.
+    """
+
+    def __init__(self, slice_steps=SLICE_STEPS) -> None:
+        self.slice_steps = slice_steps
+        self.threads = []
+        # (thread, value to resume it with) in the order they will run
+        self.ready = deque()
+        self.sleeping = 0
+        self.wakeup = None
+        self.suspended = threading.Semaphore(0)
+        self.request = None
+        # channels its threads have waited on
+        self.channels = set()
+
+    def spawn(self, func, args):
+        thread = GreenThread(self, func, args)
+        self.threads.append(thread)
+        self.ready.append((thread, None))
+        return thread
+
+    def switch(self, thread, reply=None):
+        """
+        Run thread until it suspends, returning its request.
+        """
+        global green_thread
+        with switch_lock:
+            if thread.thread is None:
+                thread.thread = threading.Thread(target=thread.run, daemon=True)
+                thread.thread.start()
+            thread.reply = reply
+            green_thread = thread
+            update_tracing()
+            try:
+                thread.resume.release()
+                self.suspended.acquire()
+            finally:
+                green_thread = None
+                update_tracing()
+            return self.request
+
+    def wake(self, thread):
+        self.sleeping -= 1
+        self.ready.append((thread, None))
+        self.wakeup.set()
+
+    async def run(self, func, args):
+        """
+        Run (func args) as the main green thread, plus every thread it
+        spawns, until the main one returns; return its value.  An error in
+        any thread stops them all and is raised here.
+        """
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        main = self.spawn(func, args)
+        try:
+            while not main.done:
+                if not self.ready:
+                    if not self.sleeping:
+                        raise SchemeEvaluationError("every green thread is waiting")
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                thread, reply = self.ready.popleft()
+                request = await loop.run_in_executor(None, self.switch, thread, reply)
+                if request[0] == "yield":
+                    self.ready.append((thread, None))
+                elif request[0] == "sleep":
+                    self.sleeping += 1
+                    loop.call_later(request[1], self.wake, thread)
+                elif request[0] == "get":
+                    request[1].getters.append(thread)
+                    self.channels.add(request[1])
+                elif request[0] == "put":
+                    request[1].putters.append((thread, request[2]))
+                    self.channels.add(request[1])
+                elif thread.error is not None:
+                    raise thread.error
+            return main.value
+        finally:
+            for thread in self.threads:
+                if thread.thread is not None and not thread.done:
+                    thread.killed = True
+                    self.switch(thread)
+            # channels may outlive this scheduler (e.g. in a global frame)
+            threads = set(self.threads)
+            for channel in self.channels:
+                channel.forget(threads)
+
+
+async def evaluate_async(tree, frame=None, slice_steps=SLICE_STEPS):
+    """
+    Evaluate tree like evaluate, as the main green thread of a new Scheduler
+    running on the current asyncio event loop, so it may use spawn, yield,
+    sleep and channels.  Green threads still running when the main one
+    returns are stopped.
+    """
+    if frame is None:
+        frame = make_global_frame()
+    return await Scheduler(slice_steps).run(lambda args: evaluate(tree, frame), [])
+
+
+def evaluate_green(tree, frame=None, slice_steps=SLICE_STEPS):
+    """
+    evaluate_async run to completion on a new event loop.
+    """
+    return asyncio.run(evaluate_async(tree, frame, slice_steps))
+
+
+#################
+# Serialization #
+#################
+
+
+class SchemePickler(pickle.Pickler):
+    def __init__(self, file, bindings=None) -> None:
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        # ids of the Pairs written so far (the memo keeps them alive), and of
+        # those still to be written bare as part of a chain
+        self.pairs = set()
+        self.chained = set()
+        # with bindings (id of a global frame -> names), each global frame is
+        # written with only those of its bindings
+        self.bindings = bindings
+
+    # builtins (some of them lambdas, and the optimizer puts them straight
+    # into trees) are sent by name and looked up again on the other side
+    def persistent_id(self, obj):
+        if obj is UNBOUND:
+            return "#unbound"
+        name = builtin_names.get(id(obj))
+        if name is not None and scheme_builtins[name] is obj:
+            return name
+        return None
+
+    def reducer_override(self, obj):
+        if type(obj) is Frame and self.bindings is not None and obj.parent is not None:
+            names = self.bindings.get(id(obj), ())
+            mappings = {name: obj.mappings[name] for name in names}
+            state = dict(obj.__dict__, mappings=mappings)
+            return (copyreg.__newobj__, (Frame,), state)
+        if type(obj) is not Pair:
+            return NotImplemented
+        if id(obj) in self.chained:
+            self.chained.remove(id(obj))
+            return (copyreg.__newobj__, (Pair,))
+        # a chain of cdrs is written as a flat list of bare Pairs followed by
+        # their cars and the final cdr, so long lists need no deep recursion
+        # and a Pair reachable from anywhere else is still written only once
+        self.pairs.add(id(obj))
+        rest = []
+        cars = [obj.car]
+        pair = obj.cdr
+        while type(pair) is Pair and id(pair) not in self.pairs:
+            self.pairs.add(id(pair))
+            self.chained.add(id(pair))
+            rest.append(pair)
+            cars.append(pair.car)
+            pair = pair.cdr
+        return (copyreg.__newobj__, (Pair,), (rest, cars, pair), None, None, link_pairs)
+
+
+def link_pairs(head, state):
+    rest, cars, tail = state
+    pairs = [head, *rest, tail]
+    for i, car_ in enumerate(cars):
+        pairs[i].car = car_
+        pairs[i].cdr = pairs[i + 1]
+
+
+class BindingCollector(SchemePickler):
+    """
+    Walks a value the way SchemePickler writes it, but with empty global
+    frames, noting the global frames it reaches and every symbol it meets
+    (in code or in data) on the way.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(io.BytesIO(), {})
+        self.frames = {}
+        self.symbols = set()
+
+    def persistent_id(self, obj):
+        if type(obj) is str:
+            self.symbols.add(obj)
+            return None
+        return super().persistent_id(obj)
+
+    def reducer_override(self, obj):
+        if type(obj) is Frame and obj.parent is not None:
+            self.frames[id(obj)] = obj
+        return super().reducer_override(obj)
+
+
+def reachable_bindings(value):
+    """
+    Return the bindings (id of a global frame -> set of names) that value can
+    use: those named anywhere in value, then those named in their values,
+    and so on.  There is no way to look a name up other than writing it, so
+    serializing value with just these bindings loses nothing it needs.
+    """
+    bindings = {}
+    frames = {}
+    symbols = set()
+    pending = [value]
+    while pending:
+        collector = BindingCollector()
+        collector.dump(pending)
+        frames.update(collector.frames)
+        symbols |= collector.symbols
+        pending = []
+        for key, frame in frames.items():
+            names = bindings.setdefault(key, set())
+            for name in symbols.intersection(frame.mappings).difference(names):
+                names.add(name)
+                pending.append(frame.mappings[name])
+    return bindings
+
+
+class SchemeUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if pid == "#unbound":
+            return UNBOUND
+        return scheme_builtins[pid]
+
+
+def serialize(value, bindings=None):
+    """
+    Return bytes that deserialize turns back into an equivalent value (in
+    this or another process).  Functions are sent as their source tree and
+    scope (or bytecode) plus the frames they captured, and shared or cyclic
+    references between frames and functions are kept.  Unforced promises
+    are sent the same way, as the source of their delayed expression (or
+    the stream builtin that computes it) plus its frame.  With bindings
+    (see reachable_bindings), global frames only keep those bindings.
+    """
+    buffer = io.BytesIO()
+    SchemePickler(buffer, bindings).dump(value)
+    return buffer.getvalue()
+
+
+def deserialize(data):
+    return SchemeUnpickler(io.BytesIO(data)).load()
+
+
+# header of an image file; bump IMAGE_VERSION whenever the classes it may
+# hold (trees, Scopes, Code and its opcodes) change
+IMAGE_MAGIC = b"SCMI"
+IMAGE_VERSION = 3
+IMAGE_HEADER = IMAGE_MAGIC + bytes([IMAGE_VERSION, *sys.version_info[:2]])
+
+
+def save_image(path, frame):
+    """
+    Write the global frame around frame (with everything reachable from it)
+    to the file at path as an image for load_image.  The file is replaced
+    at once, so readers never see a partly written image.
+    """
+    while frame.parent.parent is not None:
+        frame = frame.parent
+    data = serialize(frame)
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp, mode="wb") as file:
+            file.write(IMAGE_HEADER)
+            file.write(data)
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def load_image(path):
+    """
+    Return a new global frame restored from the image file at path, which
+    is memory-mapped and read in place.  Raises ValueError for a file that
+    is not an image written by this version of the interpreter.
+    """
+    with open(path, mode="rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[: len(IMAGE_HEADER)] != IMAGE_HEADER:
+                raise ValueError(f"{path} is not an image for this interpreter")
+            data.seek(len(IMAGE_HEADER))
+            return SchemeUnpickler(data).load()
+
+
+def image_path(token):
+    # (save-image "path"): there are no strings, so the path is a symbol,
+    # quotes and all
+    if not isinstance(token, str):
+        raise TypeError
+    if len(token) > 1 and token[0] == token[-1] == '"':
+        return token[1:-1]
+    return token
+
+
+# the directory save-image may write images in outside a budget: anywhere
+# when None (the default), nowhere when "".  Server workers use the server's
+image_directory = None
+
+
+def image_target(path):
+    """
+    The file (save-image path) writes: path itself, unless the program runs
+    under a budget or in a server worker, whose images directory it must be
+    inside.  Raises SchemeEvaluationError when it may not be written.
+    """
+    directory = image_directory if budget is None else budget.images
+    if directory is None:
+        return path
+    if not directory:
+        raise SchemeEvaluationError("save-image is not allowed here")
+    directory = os.path.realpath(directory)
+    target = os.path.realpath(os.path.join(directory, path))
+    if target == directory or os.path.commonpath([directory, target]) != directory:
+        raise SchemeEvaluationError(f"cannot write image {path} outside {directory}")
+    return target
+
+
+def save_image_form(args):
+    path, frame = args
+    target = image_target(path)
+    try:
+        save_image(target, frame)
+    except OSError:
+        raise SchemeEvaluationError(f"cannot write image {path}") from None
+    return None
+
+
+################
+# Parallel Map #
+################
+
+# worker pools for pmap by number of workers, started on first use and kept
+pmap_pools = {}
+
+
+def parallel_map(func, values, chunk_size=None, workers=None):
+    """
+    Return [func([value]) for value in values], computed in a pool of
+    workers processes (default: one per CPU) that are each sent chunk_size
+    values at a time (default: about four chunks per worker).  func and the
+    frames it captured, with just the global bindings func and values can
+    reach, are serialized once, to a temporary file each worker reads once, so set! and
+    define inside func only affect that chunk's copy; budgets and profilers
+    do not apply there.  A SchemeError raised in a worker is raised again
+    here, and a value that cannot be sent raises SchemeEvaluationError.
+    """
+    if not values:
+        return []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = -(-len(values) // (4 * workers))
+    try:
+        bindings = reachable_bindings([func, values])
+        chunks = [
+            serialize(values[i : i + chunk_size], bindings)
+            for i in range(0, len(values), chunk_size)
+        ]
+        func_data = serialize(func, bindings)
+    except (TypeError, AttributeError, pickle.PicklingError) as error:
+        # e.g. a green thread, which holds an OS thread and its locks
+        raise SchemeEvaluationError(f"pmap cannot send {error}") from None
+    pool = pmap_pools.get(workers)
+    if pool is None:
+        pool = pmap_pools[workers] = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_pmap_worker
+        )
+    descriptor, func_path = tempfile.mkstemp(suffix=".pmap")
+    # the digest tells workers apart from an earlier file with the same path
+    func_file = (func_path, hashlib.sha256(func_data).digest())
+    results = []
+    try:
+        with os.fdopen(descriptor, mode="wb") as file:
+            file.write(func_data)
+        # where save-image may write here applies in the workers too
+        images = image_directory if budget is None else budget.images
+        jobs = [(func_file, images)] * len(chunks)
+        for data in pool.map(run_pmap_chunk, jobs, chunks):
+            results.extend(deserialize(data))
+    except BrokenProcessPool:
+        # a worker died and took the pool with it; start afresh next time
+        del pmap_pools[workers]
+        raise
+    finally:
+        os.remove(func_path)
+    return results
+
+
+def init_pmap_worker():
+    # a forked worker inherits any profiler or budget active in its parent
+    global profiler, budget
+    profiler = budget = None
+    update_tracing()
+
+
+# ((path, digest), contents) of the serialized function this pmap worker
+# last read
+pmap_function = (None, None)
+
+
+def run_pmap_chunk(job, chunk_data):
+    # the serialized function is read once per call and worker, but every
+    # chunk gets a fresh copy of it, so results do not depend on which
+    # worker ran which chunks before
+    global pmap_function, image_directory
+    func_file, image_directory = job
+    key, func_data = pmap_function
+    if key != func_file:
+        with open(func_file[0], mode="rb") as file:
+            func_data = file.read()
+        pmap_function = (func_file, func_data)
+    func = deserialize(func_data)
+    return serialize([func([value]) for value in deserialize(chunk_data)])
+
+
+##########
+# Engines
+##########
+
+# compilers from a parsed expression (plus tail flag and scope) to a closure
+# over a frame; set_engine changes the one used when no engine is given
+engines = {"closure": compile_tree, "vm": compile_code}
+default_engine = "closure"
+
+
+def set_engine(name):
+    """
+    Select the execution engine ("closure" or "vm") used by evaluate and
+    result_and_frame when they are not given one explicitly.
+    """
+    global default_engine
+    if name not in engines:
+        raise ValueError(f"unknown engine {name!r}")
+    default_engine = name
+
+
+def result_and_frame(tree, frame=None, engine=None, budget=None):
+    if frame == None:
+        frame = make_global_frame()
+
+    return (evaluate(tree, frame, engine, budget), frame)
+
+
+def evaluate(tree, frame=None, engine=None, budget=None):
+    """
+    Evaluate the given syntax tree according to the rules of the Scheme
+    language.
+
+    Arguments:
+        tree (type varies): a fully parsed expression, as the output from the
+                            parse function
+        engine (str): "closure" or "vm"; defaults to the engine chosen with
+                      set_engine
+        budget (Budget): limits on the work the evaluation may do
+    """
+    if frame == None:
+        frame = make_global_frame()
+    if optimizer_enabled:
+        tree = optimize(tree, frame)
+    compile_ = engines[default_engine if engine is None else engine]
+    if budget is not None:
+        return run_budgeted(budget, lambda: compile_(tree, False, frame.scope)(frame))
+    return compile_(tree, False, frame.scope)(frame)
+
+
+####################
+# Batch Evaluation #
+####################
+
+
+def batch_files(paths):
+    """
+    The Scheme files named by paths, in order: files as given, and every
+    .scm file under a directory, sorted by path.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, _, names in os.walk(path):
+                found.extend(
+                    os.path.join(root, name) for name in names if name.endswith(".scm")
+                )
+            files.extend(sorted(found))
+        else:
+            files.append(path)
+    return files
+
+
+def init_batch_worker(engine, optimize):
+    # runs once in each worker process; the interpreter (builtins included)
+    # stays loaded for every file the worker evaluates
+    set_engine(engine)
+    set_optimizer(optimize)
+
+
+def run_batch_file(path, cache=False, image=None):
+    """
+    Evaluate the file at path in a fresh global frame (restored from the
+    image file named image, if given), returning a result
+    dict in the same form test.py uses: {"ok": True, "output": ...} with the
+    value of the last expression (numbers and booleans as they are, anything
+    else as printed), or {"ok": False, "type": ...} with the error's name.
+    """
+    try:
+        frame = make_global_frame() if image is None else load_image(image)
+        value = evaluate_file(path, frame, cache)
+    except Exception as error:
+        # any error, e.g. ZeroDivisionError from (/ 1 0), is this file's
+        # result; it must not stop the rest of the batch
+        return {"file": path, "ok": False, "type": type(error).__name__}
+    return {"file": path, "ok": True, "output": json_value(value)}
+
+
+def json_value(value):
+    # numbers, booleans and nil as they are; anything else as printed
+    if value is not None and not isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def evaluate_batch(paths, workers=None, cache=False, image=None):
+    """
+    Evaluate every file named by paths (see batch_files) independently in a
+    pool of worker processes (workers defaults to one per CPU), returning
+    their results (see run_batch_file) in input order.  With image, each
+    file starts from the global frame saved in that image file; with cache,
+    each file's parsed forms are cached next to it (see load_forms).
+    """
+    files = batch_files(paths)
+    if not files:
+        return []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_batch_worker,
+        initargs=(default_engine, optimizer_enabled),
+    ) as pool:
+        # hand out files in chunks so small scripts don't pay a round trip each
+        chunksize = max(1, len(files) // (4 * (workers or os.cpu_count() or 1)))
+        return list(
+            pool.map(
+                run_batch_file,
+                files,
+                [cache] * len(files),
+                [image] * len(files),
+                chunksize=chunksize,
+            )
+        )
+
+
+def batch_main(argv):
+    """
+    Command line entry point: python3 lab.py --batch [-j N] [--json]
+    [--cache] [--image PATH] paths...  Prints each file's result in input
+    order, then a throughput summary on stderr.  Exits with status 1 if any
+    file failed.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="lab.py --batch")
+    parser.add_argument("paths", nargs="+", help="Scheme files or directories")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument(
+        "--cache", action="store_true", help="cache parsed forms next to each file"
+    )
+    parser.add_argument("--engine", choices=sorted(engines), default=default_engine)
+    parser.add_argument("--image", help="start every file from this image")
+    options = parser.parse_args(argv)
+
+    set_engine(options.engine)
+    start = time.perf_counter()
+    results = evaluate_batch(
+        options.paths, options.workers, options.cache, options.image
+    )
+    elapsed = time.perf_counter() - start
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            if result["ok"]:
+                print(f"{result['file']}: {result['output']}")
             else:
-                return evaluate(false_exp, frame)
-        if tree[0] == "map":
-            equivalence = ["list"]
-            func = evaluate(tree[1], frame)
-            if not callable(func):
-                raise SchemeEvaluationError
-            list_ = evaluate(tree[2], frame)
-            if list_ is None:
-                return None
-            if not isinstance(list_, Pair):
-                raise SchemeEvaluationError
-            for index in range(len(list_)):
-                equivalence += [func([list_[index]])]
-            return evaluate(equivalence, frame)
-        if tree[0] == "filter":
-            equivalence = ["list"]
-            func = evaluate(tree[1], frame)
-            if not callable(func):
-                raise SchemeEvaluationError
-            list_ = evaluate(tree[2], frame)
-            if list_ is None:
-                return None
-            if not isinstance(list_, Pair):
-                raise SchemeEvaluationError
-            for index in range(len(list_)):
-                if func([list_[index]]):
-                    equivalence += [list_[index]]
-            return evaluate(equivalence, frame)
-        if tree[0] == "reduce":
-            equivalence = ["list"]
-            func = evaluate(tree[1], frame)
-            if not callable(func):
-                raise SchemeEvaluationError
-            list_ = evaluate(tree[2], frame)
-            val = evaluate(tree[3], frame)
-            if list_ is None:
-                return val
-            if not isinstance(list_, Pair):
-                raise SchemeEvaluationError
-            for index in range(len(list_)):
-                val = func([val, list_[index]])
-            return val
-        if tree[0] == "del":
+                print(f"{result['file']}: error {result['type']}")
+    failed = sum(not result["ok"] for result in results)
+    rate = len(results) / elapsed if elapsed else 0.0
+    print(
+        f"{len(results)} files ({failed} failed) in {elapsed:.3f}s: {rate:.1f} files/s",
+        file=sys.stderr,
+    )
+    return 1 if failed else 0
+
+
+#####################
+# Evaluation Server #
+#####################
+
+# messages larger than this many bytes are refused
+MAX_MESSAGE = 1 << 24
+# how long past a request's timeout a worker may take to answer before it
+# is killed and replaced
+TIMEOUT_GRACE = 1.0
+
+
+def encode_message(message):
+    """
+    The wire form of a message: its JSON encoding in UTF-8, preceded by the
+    length of that in bytes as a 4-byte big-endian integer.
+    """
+    data = json.dumps(message).encode()
+    return len(data).to_bytes(4, "big") + data
+
+
+async def read_message(reader):
+    """
+    Read one message (see encode_message) from an asyncio StreamReader,
+    returning None at the end of the stream.  Raises ValueError for a
+    message that is too long or not JSON.
+    """
+    try:
+        size = int.from_bytes(await reader.readexactly(4), "big")
+    except asyncio.IncompleteReadError:
+        return None
+    if size > MAX_MESSAGE:
+        raise ValueError("message too long")
+    return json.loads(await reader.readexactly(size))
+
+
+def serve_request(request, prelude, sessions):
+    """
+    Carry out one request in a server worker.  Sessions maps session names
+    to their global frames; a request without a session (or the first one
+    for a session) gets a fresh copy of the serialized prelude frame.
+    """
+    name = request.get("session")
+    if request.get("op") == "drop":
+        sessions.pop(name, None)
+        return {"ok": True, "output": None}
+    frame = sessions.get(name)
+    if frame is None:
+        frame = deserialize(prelude)
+        if name is not None:
+            sessions[name] = frame
+    timeout = request.get("timeout")
+    limits = None
+    if timeout is not None:
+        limits = Budget(seconds=timeout, images=image_directory)
+    value = None
+    try:
+        for tree in parse_all(tokenize(request["source"])):
+            value = evaluate(tree, frame, budget=limits)
+    except Exception as error:
+        # Python errors the program causes, e.g. (/ 1 0), end the request
+        # just like SchemeErrors, not the worker
+        return {"ok": False, "type": type(error).__name__}
+    return {"ok": True, "output": json_value(value)}
+
+
+def serve_worker(conn, prelude, engine, images):
+    # the loop of a server worker process; prelude is the serialized global
+    # frame each new session starts from, and images the only directory its
+    # programs may save images in.  The worker leads a process group of its
+    # own, so stopping it also ends any pmap workers it started
+    global image_directory
+    os.setpgrp()
+    set_engine(engine)
+    image_directory = images
+    sessions = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        conn.send(serve_request(request, prelude, sessions))
+
+
+def server_job(request, timeout=None):
+    # the checked form of a request as sent to a worker (with timeout as the
+    # default timeout), or None if the request is malformed
+    if not isinstance(request, dict):
+        return None
+    op = request.get("op", "eval")
+    session = request.get("session")
+    # a null timeout means the server default, not no limit
+    if request.get("timeout") is not None:
+        timeout = request["timeout"]
+    if op not in ("eval", "drop"):
+        return None
+    if op == "eval" and not isinstance(request.get("source"), str):
+        return None
+    if session is not None and not isinstance(session, str):
+        return None
+    if timeout is not None and (
+        isinstance(timeout, bool)
+        or not isinstance(timeout, (int, float))
+        or timeout <= 0
+    ):
+        return None
+    return {
+        "op": op,
+        "session": session,
+        "source": request.get("source"),
+        "timeout": timeout,
+    }
+
+
+class ServerWorker:
+    """
+    A worker process of a Server, and the sessions it holds.  It carries out
+    one request at a time.
+    """
+
+    def __init__(self, prelude, engine, images) -> None:
+        import multiprocessing
+
+        # forked from a fork server that has imported this module (builtins
+        # and all), so the worker starts warm but without this process's
+        # sockets and threads.  It is not a daemon, as daemons may not start
+        # the processes pmap needs; stop ends it instead
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=serve_worker, args=(child, prelude, engine, images)
+        )
+        self.process.start()
+        child.close()
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.sessions = set()
+
+    def exchange(self, request):
+        self.conn.send(request)
+        return self.conn.recv()
+
+    def stop(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # not yet in its own process group
+            pass
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class Server:
+    """
+    Evaluates Scheme source sent over a local socket by a pool of worker
+    processes started in advance with the prelude loaded: the global frame
+    saved in image, if given, plus the files in prelude.
+
+    Each request is a JSON object with the "source" to evaluate and
+    optionally a "session" name, a "timeout" in seconds and an "id" that
+    is sent back with the response.  Requests naming the same session run
+    one after another on the same worker in the same global frame, which
+    lasts until {"op": "drop", "session": ...}; other requests each start
+    from a fresh copy of the prelude.  Responses have the form
+    {"ok": True, "output": ...} or {"ok": False, "type": ...} used by
+    batch evaluation.  A request going over its timeout gets a
+    SchemeBudgetError; if its worker does not answer soon after, the worker
+    is replaced and the sessions it held are lost.  So is a worker that
+    dies, and the request it was carrying out gets {"ok": False, "type":
+    "WorkerError"}.
+
+    Clients are not trusted to write files: save-image only writes inside
+    the directory images, and not at all when that is "" (the default).
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        prelude=(),
+        image=None,
+        engine=None,
+        timeout=None,
+        images="",
+    ) -> None:
+        frame = make_global_frame() if image is None else load_image(image)
+        for path in prelude:
+            evaluate_file(path, frame)
+        self.prelude = serialize(frame)
+        self.engine = default_engine if engine is None else engine
+        self.timeout = timeout
+        self.images = images
+        self.workers = [
+            ServerWorker(self.prelude, self.engine, self.images)
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+        # the worker holding each session
+        self.sessions = {}
+        # the workers are not daemons, so they are stopped at exit at the
+        # latest, before multiprocessing waits for them
+        atexit.register(self.close)
+
+    def worker_for(self, name):
+        worker = self.sessions.get(name)
+        if worker is None:
+            if name is None:
+                return min(self.workers, key=lambda worker: worker.pending)
+            worker = min(self.workers, key=lambda worker: len(worker.sessions))
+            worker.sessions.add(name)
+            self.sessions[name] = worker
+        return worker
+
+    async def dispatch(self, request):
+        """
+        Carry out a request on a worker and return the response.
+        """
+        job = server_job(request, self.timeout)
+        if job is None:
+            return {"ok": False, "type": "BadRequest"}
+        name, timeout = job["session"], job["timeout"]
+        while True:
+            if job["op"] == "drop":
+                worker = self.sessions.pop(name, None)
+                if worker is None:
+                    return {"ok": True, "output": None}
+                worker.sessions.discard(name)
+            else:
+                worker = self.worker_for(name)
+            worker.pending += 1
             try:
-                val = frame.mappings[tree[1]]
-            except:
-                raise SchemeNameError
-            del frame[tree[1]]
-            return val
-        if tree[0] == "let":
-            new_frame = Frame()
-            new_frame.set_parent(frame)
-            temp_assignments = tree[1]
-            for var, val in temp_assignments:
-                evaluated = evaluate(val, frame)
-                new_frame[var] = evaluated
-            return evaluate(*tree[2:], new_frame)
-        if tree[0] == "set!":
-            parent = frame.get_parent_from_key(tree[1])
-            parent[tree[1]] = evaluate(tree[2], frame)
-            return parent[tree[1]]
-
-        func = evaluate(tree[0], frame)
-        if not callable(func):
-            raise SchemeEvaluationError
-        args = tree[1:]
-        args = [evaluate(arg, frame) for arg in args]
-        return func(args)
+                async with worker.lock:
+                    if worker not in self.workers:
+                        # replaced while this request waited for it
+                        continue
+                    loop = asyncio.get_running_loop()
+                    exchange = loop.run_in_executor(None, worker.exchange, job)
+                    try:
+                        if timeout is None:
+                            return await exchange
+                        return await asyncio.wait_for(exchange, timeout + TIMEOUT_GRACE)
+                    except asyncio.TimeoutError:
+                        self.replace(worker)
+                        return {"ok": False, "type": "SchemeBudgetError"}
+                    except (EOFError, OSError):
+                        self.replace(worker)
+                        return {"ok": False, "type": "WorkerError"}
+            finally:
+                worker.pending -= 1
+
+    def replace(self, worker):
+        worker.stop()
+        for name in worker.sessions:
+            del self.sessions[name]
+        self.workers[self.workers.index(worker)] = ServerWorker(
+            self.prelude, self.engine, self.images
+        )
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except ValueError:
+                    writer.write(encode_message({"ok": False, "type": "BadRequest"}))
+                    break
+                if request is None:
+                    break
+                response = await self.dispatch(request)
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write(encode_message(response))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path=None, port=0):
+        """
+        Start listening on the Unix socket at path, or else on localhost at
+        port (0 picks a free one), returning the asyncio server.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_client, path)
+        return await asyncio.start_server(self.handle_client, "127.0.0.1", port)
+
+    def close(self):
+        atexit.unregister(self.close)
+        for worker in self.workers:
+            worker.stop()
+
+
+def serve_main(argv):
+    """
+    Command line entry point: python3 lab.py --serve [--socket PATH |
+    --port N] [-j N] [--image PATH] [--timeout SECONDS] [--images DIR]
+    [prelude files...]
+    Serves until interrupted.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="lab.py --serve")
+    parser.add_argument(
+        "prelude", nargs="*", help="Scheme files every frame starts with"
+    )
+    place = parser.add_mutually_exclusive_group()
+    place.add_argument("--socket", help="listen on this Unix socket")
+    place.add_argument(
+        "--port", type=int, default=0, help="listen on this localhost port"
+    )
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--image", help="start every frame from this image")
+    parser.add_argument(
+        "--timeout", type=float, default=None, help="default request timeout"
+    )
+    parser.add_argument(
+        "--images", default="", help="the directory save-image may write in"
+    )
+    parser.add_argument("--engine", choices=sorted(engines), default=default_engine)
+    options = parser.parse_args(argv)
+
+    server = Server(
+        options.workers,
+        options.prelude,
+        options.image,
+        options.engine,
+        options.timeout,
+        options.images,
+    )
+
+    async def serve():
+        listener = await server.start(options.socket, options.port)
+        for sock in listener.sockets:
+            print(f"listening on {sock.getsockname()}", file=sys.stderr)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
 
 
 def repl(verbose=False):
@@ -625,15 +4755,58 @@ def repl(verbose=False):
     Read in a single line of user input, evaluate the expression, and print
     out the result. Repeat until user inputs "QUIT"
 
+    Files named on the command line are evaluated first.  With --profile,
+    those files and each line are run under the profiler and its report is
+    printed afterwards; --profile-json=PATH also writes the report to PATH
+    as JSON.  --sample=PATH runs them under a Sampler instead (or as well)
+    and writes its collapsed stacks to PATH.  --image=PATH starts from the
+    global frame saved in an image file (see save_image) instead of an
+    empty one.
+
     Arguments:
         verbose: optional argument, if True will display tokens and parsed
             expression in addition to more detailed error output.
     """
     import traceback
 
-    _, frame = result_and_frame(["+"])  # make a global frame
-    for arg in sys.argv[1:]:
-        evaluate(arg, frame)
+    files = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    json_paths = [
+        option.split("=", 1)[1]
+        for option in options
+        if option.startswith("--profile-json=")
+    ]
+    sample_paths = [
+        option.split("=", 1)[1] for option in options if option.startswith("--sample=")
+    ]
+    image_paths = [
+        option.split("=", 1)[1] for option in options if option.startswith("--image=")
+    ]
+    profiling = "--profile" in options or bool(json_paths)
+
+    def run(thunk):
+        if sample_paths:
+            with Sampler() as sampler:
+                result = run_profiled(thunk) if profiling else thunk()
+            for path in sample_paths:
+                sampler.write(path)
+        elif profiling:
+            result = run_profiled(thunk)
+        else:
+            return thunk()
+        if profiling:
+            print(last_profile.report())
+            for path in json_paths:
+                with open(path, mode="w") as file:
+                    file.write(last_profile.to_json())
+        return result
+
+    if image_paths:
+        frame = load_image(image_paths[-1])
+    else:
+        _, frame = result_and_frame(["+"])  # make a global frame
+    if files:
+        run(lambda: [evaluate_file(arg, frame) for arg in files])
     while True:
         input_str = input("in> ")
         if input_str == "QUIT":
@@ -645,7 +4818,7 @@ def repl(verbose=False):
             expression = parse(token_list)
             if verbose:
                 print("expression>", expression)
-            output, frame = result_and_frame(expression, frame)
+            output, frame = run(lambda: result_and_frame(expression, frame))
             print("  out>", output)
         except SchemeError as e:
             if verbose:
@@ -660,6 +4833,10 @@ if __name__ == "__main__":
     # uncommenting the following line will run doctests from above
     # doctest.testmod()
     # print(len(new_l))
+    if sys.argv[1:2] == ["--batch"]:
+        sys.exit(batch_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["--serve"]:
+        sys.exit(serve_main(sys.argv[2:]))
     repl(True)
     # l = ["cons",9,["cons", 8, ["cons", 7, "nil"]]]
     # new_l = evaluate(l)
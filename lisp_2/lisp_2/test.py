@@ -37,6 +37,23 @@ def list_from_ll(ll):
         return "SOMETHING"
 
 
+def _evaluate_source(source, frame):
+    result = None
+    for tree in lab.parse_all(lab.tokenize(source)):
+        result = lab.evaluate(tree, frame)
+    return result
+
+
+@pytest.fixture(autouse=True, params=["closure", "vm"])
+def engine(request):
+    """
+    Run every test once per execution engine; both must agree exactly.
+    """
+    lab.set_engine(request.param)
+    yield request.param
+    lab.set_engine("closure")
+
+
 def make_tester(func):
     """
     Helper to wrap a function so that, when called, it produces a
@@ -285,6 +302,80 @@ def test_oldbehaviors():
     do_raw_continued_evaluations(27)
     do_raw_continued_evaluations(28)
 
+# TESTS FOR THE STREAMING TOKENIZER
+
+
+def test_generate_tokens_positions():
+    source = "(define (f x)\n  ; comment (\n\t(+ x 1)) ; done"
+    expected = [
+        ("(", (1, 1)),
+        ("define", (1, 2)),
+        ("(", (1, 9)),
+        ("f", (1, 10)),
+        ("x", (1, 12)),
+        (")", (1, 13)),
+        ("(", (3, 2)),
+        ("+", (3, 3)),
+        ("x", (3, 5)),
+        ("1", (3, 7)),
+        (")", (3, 8)),
+        (")", (3, 9)),
+    ]
+    assert list(lab.generate_tokens(source)) == expected
+    assert lab.tokenize(source) == [token for token, _ in expected]
+
+
+def test_generate_tokens_chunks():
+    with open(os.path.join(TEST_DIRECTORY, "test_files", "sudoku.scm")) as f:
+        source = f.read()
+    expected = list(lab.generate_tokens(source))
+    for size in (1, 2, 7, 4096):
+        chunks = [source[i : i + size] for i in range(0, len(source), size)]
+        assert list(lab.generate_tokens(chunks)) == expected
+    with open(os.path.join(TEST_DIRECTORY, "test_files", "sudoku.scm")) as f:
+        assert list(lab.generate_tokens(f)) == expected
+
+
+# TESTS FOR THE SINGLE-PASS PARSER
+
+
+def test_parse_all():
+    run_test_number(94, lab.parse_all)
+
+
+def test_parse_deep_nesting():
+    depth = 100_000
+    tokens = ["("] * depth + ["x"] + [")"] * depth
+    tree = lab.parse(tokens)
+    for _ in range(depth):
+        assert len(tree) == 1
+        tree = tree[0]
+    assert tree == "x"
+
+
+def test_compact_forms():
+    tokens = lab.tokenize("(define (f x) (if (> x 1.5) (* x -2) inf)) f")
+    tree, name = lab.parse_all(tokens)
+    branch = ["if", [">", "x", 1.5], ["*", "x", -2], float("inf")]
+    assert tree == ["define", ["f", "x"], branch]
+    assert name == "f"
+    compact, _ = lab.iter_forms(tokens, compact=True)
+    branch = ("if", (">", "x", 1.5), ("*", "x", -2), float("inf"))
+    assert compact == ("define", ("f", "x"), branch)
+    # symbols are interned: every occurrence of a name is the same object
+    assert compact[1][1] is compact[2][1][1] is lab.parse(["".join(["x"])])
+    assert lab.atom("NaN") != lab.atom("NaN")
+    atoms = ("+", "-", ".5", "1e3", "1_000", "1.2.3", "-x", "infinity", "if", "nil")
+    for token in atoms:
+        assert lab.atom(token) == lab.number_or_symbol(token)
+    frame = lab.make_global_frame()
+    body = lab.evaluate(compact, frame).expression  # optimized, still compact
+    assert type(body) is tuple and type(body[1]) is tuple and body[3] == float("inf")
+    assert lab.evaluate(("f", 3), frame) == -6
+    assert lab.evaluate(("f", 1), frame) == float("inf")
+    assert lab.evaluate(("let", (("y", 2),), ("f", "y")), frame) == -4
+
+
 # BOOLEANS AND CONDITIONALS
 
 
@@ -373,6 +464,14 @@ def test_append():
 def test_list_ops():
     do_raw_continued_evaluations(47)
 
+
+# TESTS FOR THE LIST LIBRARY
+
+
+def test_list_library():
+    do_raw_continued_evaluations(99)
+
+
 # TESTS FOR MAP FILTER REDUCE
 
 def test_map_builtin():
@@ -396,6 +495,86 @@ def test_reduce_carlaefunc():
 def test_map_filter_reduce():
     do_raw_continued_evaluations(84)
 
+def test_map_filter_reduce_sequences():
+    do_raw_continued_evaluations(97)
+
+
+# TESTS FOR PARALLEL MAP
+
+
+def test_pmap():
+    do_raw_continued_evaluations(103)
+    # an unforced stream elsewhere in the global frame is sent along
+    frame = lab.make_global_frame()
+    result = _evaluate_source(
+        """
+        (define nat (integers-from 0))
+        (define (sq x) (* x x))
+        (pmap sq (list 1 2 3) 1 2)
+        """,
+        frame,
+    )
+    assert list_from_ll(result) == [1, 4, 9]
+    # only the globals the function can reach are sent, so a green thread
+    # elsewhere in the frame is no obstacle, but one it uses is an error
+    _evaluate_green("(define t (spawn (lambda () 1)))", frame)
+    assert list_from_ll(_evaluate_source("(pmap sq (list 1 2) 1 2)", frame)) == [1, 4]
+    with pytest.raises(lab.SchemeEvaluationError):
+        _evaluate_source("(pmap (lambda (x) t) (list 1 2) 1 2)", frame)
+    assert lab.reachable_bindings(frame["sq"]) == {id(frame): {"sq"}}
+
+
+def test_serialize():
+    frame = lab.make_global_frame()
+    _evaluate_source(
+        """
+        (define (make-counter n) (lambda () (begin (set! n (+ n 1)) n)))
+        (define tick (make-counter 10))
+        (define (even? n) (if (equal? n 0) #t (odd? (- n 1))))
+        (define (odd? n) (if (equal? n 0) #f (even? (- n 1))))
+        (define big (range 50000))
+        (define here (lambda () here))
+        """,
+        frame,
+    )
+    copy = lab.deserialize(lab.serialize(frame))
+    assert copy is not frame
+    assert copy.parent.mappings.keys() == frame.parent.mappings.keys()
+    assert copy.parent.mappings["car"] is lab.scheme_builtins["car"]
+    assert _evaluate_source("(tick) (tick)", copy) == 12
+    assert _evaluate_source("(tick)", frame) == 11
+    assert _evaluate_source("(even? 1001)", copy) is False
+    assert _evaluate_source("(length big)", copy) == 50000
+    assert _evaluate_source("(equal? (here) here)", copy) is True
+    assert copy["here"].frame is copy
+
+    outer = lab.make_list([1, 2, 3])
+    inner, copy_outer = lab.deserialize(lab.serialize([outer.cdr, outer]))
+    assert copy_outer.cdr is inner and lab.pair_values(copy_outer) == [1, 2, 3]
+
+    tree = lab.optimize(lab.parse(lab.tokenize("(lambda (x) (car (cdr x)))")), frame)
+    assert lab.deserialize(lab.serialize(tree)) == tree
+
+    # unforced promises are sent as their source, like functions
+    _evaluate_source(
+        """
+        (define nat (integers-from 0))
+        (define big-ones (stream-filter (lambda (x) (> x 5)) nat))
+        (define squares (stream-map (lambda (x) (* x x)) nat))
+        (define later (delay (tick)))
+        (define ticks (cons-stream (tick) (cons-stream (tick) nil)))
+        """,
+        frame,
+    )
+    copy = lab.deserialize(lab.serialize(frame))
+    squares = _evaluate_source("(stream-take squares 4)", copy)
+    assert list_from_ll(squares) == [0, 1, 4, 9]
+    assert list_from_ll(_evaluate_source("(stream-take big-ones 3)", copy)) == [6, 7, 8]
+    assert _evaluate_source("(force later)", copy) == 13
+    assert _evaluate_source("(stream-car (stream-cdr ticks))", copy) == 14
+    assert _evaluate_source("(tick)", frame) == 13
+
+
 # TESTS FOR READING CODE FROM FILES
 
 def test_begin():
@@ -419,6 +598,51 @@ def test_file_4():
 def test_file_5():
     compare_outputs(*_test_file("small_test5.scm", 86))
 
+def test_file_6():
+    compare_outputs(*_test_file("small_test6.scm", 95))
+
+def test_file_forms():
+    results = lab.evaluate_file_forms(
+        os.path.join(TEST_DIRECTORY, "test_files", "small_test6.scm")
+    )
+    assert list_from_ll(next(results)) == "SOMETHING"
+    assert [list_from_ll(result) for result in results] == [0, 9, 25, [25, 625]]
+
+def test_file_cache(tmp_path, monkeypatch):
+    source = tmp_path / "prog.scm"
+    cache = tmp_path / "prog.scmc"
+    source.write_text("(define x 3)\n(* x x)")
+    assert lab.evaluate_file(str(source)) == 9
+    assert not cache.exists()  # only written when asked for
+    assert lab.evaluate_file(str(source), cache=True) == 9
+    assert cache.exists()
+
+    def no_parsing(tokens, compact=False):
+        raise AssertionError("parsed despite a valid cache")
+
+    with monkeypatch.context() as m:
+        m.setattr(lab, "iter_forms", no_parsing)
+        assert lab.load_forms(str(source)) == [("define", "x", 3), ("*", "x", "x")]
+        assert lab.evaluate_file(str(source), cache=True) == 9
+
+    source.write_text("(+ 1 2)")  # stale cache
+    assert lab.evaluate_file(str(source), cache=True) == 3
+    cache.write_bytes(b"garbage")  # corrupt cache
+    assert lab.evaluate_file(str(source), cache=True) == 3
+    assert lab.load_forms(str(source)) == [("+", 1, 2)]
+    cache.unlink()
+    cache.mkdir()  # the cache can't be replaced; no temporary file is left
+    assert lab.load_forms(str(source)) == [("+", 1, 2)]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["prog.scm", "prog.scmc"]
+
+def test_file_cache_syntax_error(tmp_path):
+    source = tmp_path / "prog.scm"
+    source.write_text("(define x 3)\n(* x x))")
+    frame = lab.make_global_frame()
+    with pytest.raises(lab.SchemeSyntaxError):
+        lab.evaluate_file(str(source), frame)
+    assert lab.evaluate(["+", "x", 1], frame) == 4
+
 def test_del():
     do_raw_continued_evaluations(52)
 
@@ -479,6 +703,639 @@ def test_sudoku_solver():
     do_raw_continued_evaluations(66)
 
 
+# TESTS FOR VECTORS
+
+
+def test_vectors():
+    do_raw_continued_evaluations(96)
+
+
+def test_vector_printing():
+    vector = lab.evaluate(lab.parse(lab.tokenize("(vector 1 (vector 2 3) 4.5)")))
+    assert str(vector) == "#(1 #(2 3) 4.5)"
+
+
+# TESTS FOR NDARRAYS
+
+
+def test_ndarrays():
+    do_raw_continued_evaluations(102)
+
+
+def test_ndarray_storage():
+    array_ = lab.make_ndarray([lab.make_list([2, 3])])
+    assert array_.data.typecode == "q" and array_.strides == (3, 1)
+    lab.nd_set([array_, lab.make_list([1, 1]), 2.5])
+    assert array_.data.typecode == "d"
+    assert array_.data.tolist() == [0, 0, 0, 0, 2.5, 0]
+    assert str(array_) == "#<ndarray 2x3>"
+
+
+# TESTS FOR PROMISES AND STREAMS
+
+
+def test_streams():
+    do_raw_continued_evaluations(98)
+
+
+# TESTS FOR PROPER TAIL CALLS
+
+
+def test_tail_calls():
+    do_raw_continued_evaluations(93)
+
+
+# TESTS FOR MEMOIZATION
+
+
+def test_memoize():
+    do_raw_continued_evaluations(100)
+    # numbers and booleans Python considers equal are different arguments
+    frame = lab.make_global_frame()
+    _evaluate_source("(define-memo (wrap x) (list x))", frame)
+    for value in ["1", "1.0", "#t", "1", "#f", "0"]:
+        result = _evaluate_source(f"(wrap {value})", frame)
+        expected = _evaluate_source(value, frame)
+        assert type(result.car) is type(expected) and result.car == expected
+
+
+# TESTS FOR THE OPTIMIZER
+
+
+def test_optimizer():
+    do_raw_continued_evaluations(101)
+
+
+def test_optimizer_off(monkeypatch):
+    monkeypatch.setattr(lab, "optimizer_enabled", False)
+    do_raw_continued_evaluations(101)
+
+
+def test_optimize_trees():
+    frame = lab.make_global_frame()
+    optimize = lambda source: lab.optimize(lab.parse(lab.tokenize(source)), frame)
+    assert optimize("(+ 1 (* 2 3))") == 7
+    assert optimize("(if #t x (car 5))") == "x"
+    assert optimize("(begin 1 x 2 y)") == ["begin", "x", "y"]
+    assert optimize("(lambda (+) (+ 1 2))") == ["lambda", ["+"], ["+", 1, 2]]
+    assert optimize("(begin (set! car cdr) (car x))")[2] == ["car", "x"]
+    assert optimize("(car x)") == [lab.scheme_builtins["car"], "x"]
+    assert optimize("(/ 1 0)") == [lab.scheme_builtins["/"], 1, 0]
+    lab.evaluate(lab.parse(lab.tokenize("(define (sq x) (* x x))")), frame)
+    assert optimize("(sq 4)") == 16
+    assert optimize("(lambda (y) (sq y))")[2] == [lab.scheme_builtins["*"], "y", "y"]
+    assert optimize("(sq (f 1))") == ["sq", ["f", 1]]
+
+
+def test_optimizer_late_binding():
+    # names rebound by later forms are seen by functions optimized earlier
+    cases = [
+        ("(define (f l) (reverse l)) (define (reverse l) 42) (f (list 1 2))", 42),
+        ("(define (f x) (car x)) (define car (lambda (x) 42)) (f (list 1 2))", 42),
+        (
+            "(define (sq x) (* x x)) (define (g y) (sq y)) (define (sq x) 0)"
+            " (define n 5) (g n)",
+            0,
+        ),
+        ("(define (f) (+ 1 2)) (f) (set! + -) (f)", -1),
+        ("(define (f) (not #f)) (f) (define (not x) 7) (f)", 7),
+    ]
+    for source, expected in cases:
+        assert _evaluate_source(source, lab.make_global_frame()) == expected
+    frame = lab.make_global_frame()
+    _evaluate_source(
+        "(define (sq x) (* x x)) (define s (cons-stream 1 (sq 3)))", frame
+    )
+    _evaluate_source("(define (sq x) x)", frame)
+    assert _evaluate_source("(force (cdr s))", frame) == 3
+
+
+def test_optimizer_rebinds_per_frame():
+    # a rebinding only affects the lambdas of its own global frame that
+    # depend on the rebound name
+    frame, other = lab.make_global_frame(), lab.make_global_frame()
+    _evaluate_source(
+        "(define (sq x) (* x x)) (define (f y) (sq y)) (define (g y) (+ y 1))", frame
+    )
+    f, g = (frame[name].scope.unoptimized for name in ("f", "g"))
+    _evaluate_source("(define (sq x) 0) (define + -)", other)
+    assert not f.stale and not g.stale
+    _evaluate_source("(define (sq x) x)", frame)
+    assert f.stale and not g.stale
+    assert list_from_ll(_evaluate_source("(list (f 3) (g 3))", frame)) == [3, 4]
+
+
+# TESTS FOR THE PROFILER
+
+
+def test_profile(capsys):
+    frame = lab.make_global_frame()
+    _evaluate_source(
+        """
+        (define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+        (define (loop n) (if (equal? n 0) 0 (loop (- n 1))))
+        (define (twice f x) (f (f x)))
+        """,
+        frame,
+    )
+    assert _evaluate_source("(profile (fib 10))", frame) == 55
+    stats = lab.last_profile.stats
+    assert stats["fib"][0] == 177
+    assert stats["+"][0] == 88
+    calls, self_time, cumulative = stats["fib"]
+    assert 0 <= self_time <= cumulative
+    assert "fib" in capsys.readouterr().out
+    assert lab.profiler is None
+
+    assert _evaluate_source("(profile (loop 20000))", frame) == 0
+    assert lab.last_profile.stats["loop"][0] == 20001
+    assert _evaluate_source("(profile (twice (lambda (y) (* y 3)) 2))", frame) == 18
+    assert lab.last_profile.stats["(lambda (y) (* y 3))"][0] == 2
+    rows = json.loads(lab.last_profile.to_json())
+    assert {row["function"] for row in rows} == {"twice", "(lambda (y) (* y 3))", "*"}
+    assert rows == sorted(rows, key=lambda row: -row["cumulative"])
+    assert set(rows[0]) == {"function", "calls", "self", "cumulative"}
+
+    with pytest.raises(lab.SchemeEvaluationError):
+        _evaluate_source("(profile (fib))", frame)
+    assert lab.profiler is None
+    assert lab.last_profile.stats["fib"][0] == 1
+
+    # calls the optimizer would inline, in the profiled expression or in the
+    # functions it calls, are still profiled
+    _evaluate_source("(define (sq x) (* x x)) (define (h y) (sq y))", frame)
+    assert _evaluate_source("(profile (sq 3))", frame) == 9
+    assert lab.last_profile.stats["sq"][0] == 1
+    assert _evaluate_source("(profile (h 3))", frame) == 9
+    assert set(lab.last_profile.stats) == {"h", "sq", "*"}
+    assert _evaluate_source("(h 4)", frame) == 16
+
+
+def test_sampler(tmp_path):
+    frame = lab.make_global_frame()
+    _evaluate_source(
+        """
+        (define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+        (define (go n) (if (equal? n 0) 0 (begin (fib 15) (go (- n 1)))))
+        """,
+        frame,
+    )
+    with lab.Sampler(interval=0.0005) as sampler:
+        for _ in range(200):
+            _evaluate_source("(go 1)", frame)
+            if sum(sampler.counts.values()) >= 5:
+                break
+    lines = sampler.collapsed().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack == "<toplevel>" or stack.split(";")[0] == "go"
+    assert any(line.startswith("go;fib") for line in lines)
+    sampler.write(tmp_path / "stacks.txt")
+    assert (tmp_path / "stacks.txt").read_text() == sampler.collapsed()
+
+
+# TESTS FOR EXECUTION BUDGETS
+
+
+def _budget_frame():
+    frame = lab.make_global_frame()
+    _evaluate_source(
+        """
+        (define counter 0)
+        (define (spin) (begin (set! counter (+ counter 1)) (spin)))
+        (define (down n) (if (equal? n 0) 0 (+ 1 (down (- n 1)))))
+        (define (count n) (if (equal? n 0) 0 (count (- n 1))))
+        """,
+        frame,
+    )
+    return frame
+
+
+def _evaluate_budgeted(source, frame, budget):
+    return lab.evaluate(lab.parse(lab.tokenize(source)), frame, budget=budget)
+
+
+def test_budget_steps():
+    frame = _budget_frame()
+    budget = lab.Budget(steps=1000)
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(spin)", frame, budget)
+    assert 300 < lab.evaluate(lab.parse(["counter"]), frame) <= 1000
+    assert lab.budget is None and not lab.tracing
+    budget = lab.Budget(steps=1000)
+    assert _evaluate_budgeted("(count 100)", frame, budget) == 0
+    assert 100 < budget.steps < 1000
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(count 1000)", frame, budget)
+
+
+def test_budget_deadline():
+    frame = _budget_frame()
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(spin)", frame, lab.Budget(seconds=0.05))
+
+
+def test_budget_depth():
+    frame = _budget_frame()
+    assert _evaluate_budgeted("(down 50)", frame, lab.Budget(depth=100)) == 50
+    assert _evaluate_budgeted("(count 5000)", frame, lab.Budget(depth=10)) == 0
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(down 200)", frame, lab.Budget(depth=100))
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(down 100000)", frame, lab.Budget())
+
+
+def test_budget_allocations():
+    frame = _budget_frame()
+    budget = lab.Budget(allocations=1000)
+    assert _evaluate_budgeted("(length (list 1 2 3))", frame, budget) == 3
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(range 1000000)", frame, budget)
+    with pytest.raises(lab.SchemeBudgetError):
+        _evaluate_budgeted("(down 2000)", frame, lab.Budget(allocations=1000))
+    assert lab.result_and_frame(["+", 1, 2], frame, budget=lab.Budget(steps=5))[0] == 3
+
+
+# TESTS FOR BATCH EVALUATION
+
+
+def test_evaluate_batch(tmp_path):
+    (tmp_path / "a.scm").write_text("(define x 3)\n(* x x)")
+    (tmp_path / "b.scm").write_text("(car 5)")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "c.scm").write_text("(+ 1")
+    (tmp_path / "nested" / "e.scm").write_text("(define x 0)\n(/ 1 x)")
+    (tmp_path / "notes.txt").write_text("not scheme")
+    single = tmp_path / "d.scm"
+    single.write_text("(define (f n) (if (equal? n 0) 0 (f (- n 1))))\n(f 100000)")
+    results = lab.evaluate_batch([str(single), str(tmp_path)], workers=2)
+    assert [os.path.relpath(result["file"], tmp_path) for result in results] == [
+        "d.scm",
+        "a.scm",
+        "b.scm",
+        "d.scm",
+        os.path.join("nested", "c.scm"),
+        os.path.join("nested", "e.scm"),
+    ]
+    assert [result["ok"] for result in results] == [
+        True,
+        True,
+        False,
+        True,
+        False,
+        False,
+    ]
+    assert results[1]["output"] == 9 and results[0]["output"] == 0
+    assert results[2]["type"] == "SchemeEvaluationError"
+    assert results[4]["type"] == "SchemeSyntaxError"
+    assert results[5]["type"] == "ZeroDivisionError"
+    # nothing is written next to the scripts unless the cache is asked for
+    assert not list(tmp_path.rglob("*.scmc"))
+    assert lab.evaluate_batch([], workers=2) == []
+
+
+# TESTS FOR BENCHMARKS
+
+
+def test_benchmarks():
+    import bench
+
+    report = bench.run_benchmarks(["cons", "call"], repeat=2, warmup=0)
+    assert report["engine"] == lab.default_engine
+    assert list(report["benchmarks"]) == ["call", "cons"]
+    cons = report["benchmarks"]["cons"]
+    assert cons["layer"] == "micro" and cons["number"] == 10000
+    assert 0 < cons["min"] <= cons["median"]
+    assert cons["allocations"] == 10000 and cons["calls"] == 10000
+    assert report["benchmarks"]["call"]["allocations"] == 10000
+
+    baseline = json.loads(json.dumps(report))
+    baseline["benchmarks"]["call"]["median"] *= 2
+    baseline["benchmarks"]["cons"]["median"] /= 2
+    verdicts = {row[0]: row[4] for row in bench.compare(report, baseline, 0.1)}
+    assert verdicts == {"call": "faster", "cons": "slower"}
+    # the multi-second sudoku boards only run when asked for
+    assert bench.slow_benchmarks == {"sudoku-board2", "sudoku-board3"}
+
+
+# TESTS FOR IMAGES
+
+
+def test_image(tmp_path):
+    frame = lab.make_global_frame()
+    path = tmp_path / "prelude.img"
+    _evaluate_source(
+        f"""
+        (define (make-counter n) (lambda () (begin (set! n (+ n 1)) n)))
+        (define tick (make-counter 0))
+        (tick)
+        (define shared (list 1 2 3))
+        (define pair-of-shared (cons shared shared))
+        (define front (cons 0 shared))
+        (define (loop n) (if (equal? n 0) -1 (loop (- n 1))))
+        (define (save) (let ((x 1)) (save-image "{path}")))
+        (save)
+        """,
+        frame,
+    )
+    image = lab.load_image(str(path))
+    assert image is not frame and image.parent.parent is None
+    assert _evaluate_source("(tick)", image) == 2
+    assert _evaluate_source("(loop 100000)", image) == -1
+    assert image["pair-of-shared"].car is image["pair-of-shared"].cdr
+    assert image["front"].cdr is image["shared"]
+    assert image["tick"].frame.parent is image
+
+    _evaluate_source(f"(define later 5) (save-image {path})", image)
+    assert lab.load_image(str(path))["later"] == 5
+
+    # global streams and unforced promises are part of the environment
+    _evaluate_source(
+        f"""
+        (define nat (integers-from 0))
+        (define evens (stream-map (lambda (x) (* 2 x)) nat))
+        (define p (delay (tick)))
+        (save-image {path})
+        """,
+        image,
+    )
+    streams = lab.load_image(str(path))
+    assert list_from_ll(_evaluate_source("(stream-take evens 3)", streams)) == [0, 2, 4]
+    assert _evaluate_source("(force p)", streams) == 3
+    assert _evaluate_source("(force p)", image) == 3
+
+    (tmp_path / "not-an-image").write_bytes(b"SCMC0000")
+    with pytest.raises(ValueError):
+        lab.load_image(str(tmp_path / "not-an-image"))
+    for source in ["(save-image)", "(save-image 5)", '(save-image "a" "b")']:
+        with pytest.raises(lab.SchemeSyntaxError):
+            _evaluate_source(source, frame)
+    with pytest.raises(lab.SchemeEvaluationError):
+        _evaluate_source(f"(save-image {tmp_path / 'missing' / 'x.img'})", frame)
+
+
+def test_image_untrusted(tmp_path):
+    # budgeted programs may only save images inside the budget's directory
+    frame = lab.make_global_frame()
+    _evaluate_source("(define x 5)", frame)
+    outside = tmp_path / "outside.img"
+    with pytest.raises(lab.SchemeEvaluationError):
+        _evaluate_budgeted(f"(save-image {outside})", frame, lab.Budget())
+    images = tmp_path / "images"
+    images.mkdir()
+    budget = lab.Budget(images=str(images))
+    for path in [outside, "../outside.img", images]:
+        with pytest.raises(lab.SchemeEvaluationError):
+            _evaluate_budgeted(f"(save-image {path})", frame, budget)
+    # nor may pmap's workers
+    source = f"(pmap (lambda (n) (save-image {outside})) (list 1) 1 1)"
+    with pytest.raises(lab.SchemeEvaluationError):
+        _evaluate_budgeted(source, frame, budget)
+    assert not outside.exists()
+    _evaluate_budgeted("(save-image inside.img)", frame, budget)
+    assert lab.load_image(str(images / "inside.img"))["x"] == 5
+
+
+def test_batch_image(tmp_path):
+    frame = lab.make_global_frame()
+    _evaluate_source("(define (square x) (* x x))", frame)
+    lab.save_image(str(tmp_path / "prelude.img"), frame)
+    (tmp_path / "a.scm").write_text("(square 7)")
+    results = lab.evaluate_batch(
+        [str(tmp_path / "a.scm")], workers=1, image=str(tmp_path / "prelude.img")
+    )
+    assert results[0]["output"] == 49
+
+
+# TESTS FOR GREEN THREADS
+
+
+def _evaluate_green(source, frame):
+    result = None
+    for tree in lab.parse_all(lab.tokenize(source)):
+        result = lab.evaluate_green(tree, frame)
+    return result
+
+
+def test_green_threads():
+    frame = lab.make_global_frame()
+    _evaluate_green(
+        """
+        (define ch (make-channel 2))
+        (define out (make-channel))
+        (define (producer n)
+          (if (equal? n 0)
+              (channel-put ch -1)
+              (begin (channel-put ch n) (producer (- n 1)))))
+        (define (consumer total)
+          (let ((v (channel-get ch)))
+            (if (equal? v -1) (channel-put out total) (consumer (+ total v)))))
+        (define (spin) (spin))
+        """,
+        frame,
+    )
+    source = "(begin (spawn producer 100) (spawn consumer 0) (channel-get out))"
+    assert _evaluate_green(source, frame) == 5050
+    # spin never yields; it is switched out when its time slice runs out,
+    # and stopped when the main thread returns
+    assert _evaluate_green("(begin (spawn spin) (yield) 42)", frame) == 42
+    order = _evaluate_green(
+        """
+        (begin
+          (define c (make-channel))
+          (spawn (lambda () (begin (sleep 0.03) (channel-put c 1))))
+          (spawn (lambda () (begin (sleep 0.01) (channel-put c 2))))
+          (spawn (lambda () (begin (sleep 0.02) (channel-put c 3))))
+          (list (channel-get c) (channel-get c) (channel-get c)))
+        """,
+        frame,
+    )
+    assert list_from_ll(order) == [2, 3, 1]
+    source = """
+    (let ((r (make-channel 0)))
+      (begin (spawn channel-put r 7) (channel-get r)))
+    """
+    assert _evaluate_green(source, frame) == 7
+
+    for source in [
+        "(channel-get (make-channel))",
+        "(begin (spawn car 1) (sleep 0.01) 5)",
+        "(channel-put (make-channel 0) 1)",
+    ]:
+        with pytest.raises(lab.SchemeEvaluationError):
+            _evaluate_green(source, frame)
+    with pytest.raises(lab.SchemeEvaluationError):
+        _evaluate_source("(spawn spin)", frame)
+    assert _evaluate_source("(yield)", frame) is None
+    assert lab.green_thread is None and not lab.tracing
+
+    # threads stopped while waiting on a channel that outlives their
+    # scheduler no longer wait on it
+    _evaluate_source("(define g (make-channel))", frame)
+    assert _evaluate_green("(begin (spawn channel-get g) (yield) 1)", frame) == 1
+    assert _evaluate_source("(channel-put g 5)", frame) is None
+    assert _evaluate_green("(begin (channel-put g 6) (channel-get g))", frame) == 5
+
+
+def test_green_threads_share_loop():
+    import asyncio
+
+    source = """
+    (begin (define (loop n) (if (equal? n 0) n (loop (- n 1))))
+           (loop 20000))
+    """
+    tree = lab.parse(lab.tokenize(source))
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        results = await asyncio.gather(
+            lab.evaluate_async(tree), lab.evaluate_async(tree)
+        )
+        task.cancel()
+        return results, ticks
+
+    results, ticks = asyncio.run(run())
+    assert results == [0, 0] and ticks > 10
+
+
+def test_green_threads_preempt_builtins():
+    import asyncio
+
+    # building a long list calls no Scheme function, but is preempted anyway
+    frame = lab.make_global_frame()
+    source = """
+    (begin (define seen 0)
+           (spawn (lambda () (set! seen 1)))
+           (define n (length (sort (range 100000) >)))
+           seen)
+    """
+    assert _evaluate_green(source, frame) == 1
+    assert frame["n"] == 100000
+
+    tree = lab.parse(lab.tokenize("(length (range 200000))"))
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        result = await lab.evaluate_async(tree)
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result == 200000 and ticks > 10
+
+
+# TESTS FOR THE EVALUATION SERVER
+
+
+def test_server(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(lab, "TIMEOUT_GRACE", 0.1)
+    prelude = os.path.join(TEST_DIRECTORY, "test_files", "definitions.scm")
+    server = lab.Server(workers=2, prelude=[prelude])
+
+    async def run():
+        listener = await server.start(str(tmp_path / "lisp.sock"))
+        reader, writer = await asyncio.open_unix_connection(str(tmp_path / "lisp.sock"))
+
+        async def ask(request):
+            writer.write(lab.encode_message(request))
+            await writer.drain()
+            return await lab.read_message(reader)
+
+        save = f'(save-image "{tmp_path / "client.img"}")'
+        responses = [
+            await ask({"id": 7, "source": "(square (fib 10))"}),
+            await ask({"session": "a", "source": "(define square +) (define x 5)"}),
+            await ask({"session": "a", "source": "(square x x)"}),
+            await ask({"session": "b", "source": "(define y 2)"}),
+            await ask({"source": "(square 3)"}),
+            await ask({"source": "x"}),
+            await ask({"source": "(define (f) (f)) (f)", "timeout": 0.2}),
+            await ask({"session": "a", "source": "(list x x)"}),
+            await ask({"op": "drop", "session": "a"}),
+            await ask({"session": "a", "source": "x"}),
+            # sleep never checks the budget, so the worker is replaced
+            await ask({"session": "b", "source": "(sleep 5)", "timeout": 0.1}),
+            await ask({"session": "b", "source": "y"}),
+            await ask({"source": 5}),
+            await ask({"source": "1", "timeout": -1}),
+            # Python errors end the request, not the worker
+            await ask({"source": "(/ 1 0)"}),
+            await ask({"source": "(+ 1 (cons 1 2))"}),
+            await ask({"source": "(+ 3 4)"}),
+            # workers may start pmap's worker processes
+            await ask({"source": "(pmap (lambda (x) (* x x)) (list 1 2 3) 1 2)"}),
+            # but clients may not write files
+            await ask({"source": save}),
+            await ask({"source": save, "timeout": 1}),
+        ]
+        # a worker that dies is replaced
+        server.workers[0].process.kill()
+        server.workers[0].process.join()
+        responses.append(await ask({"source": "(+ 3 4)"}))
+        responses.append(await ask({"source": "(+ 3 4)"}))
+        writer.close()
+        await writer.wait_closed()
+        await asyncio.sleep(0.05)
+        listener.close()
+        await listener.wait_closed()
+        return responses
+
+    try:
+        responses = asyncio.run(run())
+    finally:
+        server.close()
+    assert responses == [
+        {"ok": True, "output": 3025, "id": 7},
+        {"ok": True, "output": 5},
+        {"ok": True, "output": 10},
+        {"ok": True, "output": 2},
+        {"ok": True, "output": 9},
+        {"ok": False, "type": "SchemeNameError"},
+        {"ok": False, "type": "SchemeBudgetError"},
+        {"ok": True, "output": "[5, 5]"},
+        {"ok": True, "output": None},
+        {"ok": False, "type": "SchemeNameError"},
+        {"ok": False, "type": "SchemeBudgetError"},
+        {"ok": False, "type": "SchemeNameError"},
+        {"ok": False, "type": "BadRequest"},
+        {"ok": False, "type": "BadRequest"},
+        {"ok": False, "type": "ZeroDivisionError"},
+        {"ok": False, "type": "TypeError"},
+        {"ok": True, "output": 7},
+        {"ok": True, "output": "[1, 4, 9]"},
+        {"ok": False, "type": "SchemeEvaluationError"},
+        {"ok": False, "type": "SchemeEvaluationError"},
+        {"ok": False, "type": "WorkerError"},
+        {"ok": True, "output": 7},
+    ]
+    assert not (tmp_path / "client.img").exists()
+    assert lab.encode_message({"a": 1}) == b"\x00\x00\x00\x08" + b'{"a": 1}'
+    # a null timeout falls back to the server default
+    assert lab.server_job({"source": "1", "timeout": None}, 2)["timeout"] == 2
+    assert lab.server_job({"source": "1", "timeout": 0.5}, 2)["timeout"] == 0.5
+    assert lab.server_job({"source": "1"}, 2)["timeout"] == 2
+
+
 if __name__ == "__main__":
     import sys
 
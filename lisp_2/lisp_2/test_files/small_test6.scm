@@ -0,0 +1,6 @@
+; several top-level forms, evaluated one after another in the same frame
+(define (square x) (* x x))
+(define total 0)
+(set! total (+ total (square 3)))
+(set! total (+ total (square 4)))
+(list total (square total))
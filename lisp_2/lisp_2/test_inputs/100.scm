@@ -0,0 +1,32 @@
+(define calls 0)
+(define-memo (fib n) (begin (set! calls (+ calls 1)) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))
+(fib 30)
+calls
+(fib 30)
+calls
+(memo-stats fib)
+(fib 200)
+(define (count-paths r c) (if (or (equal? r 0) (equal? c 0)) 1 (+ (count-paths (- r 1) c) (count-paths r (- c 1)))))
+(define count-paths (memoize count-paths))
+(count-paths 16 16)
+(define seen 0)
+(define (total l) (begin (set! seen (+ seen 1)) (fold-left + 0 l)))
+(define total (memoize total))
+(total (list 1 2 3))
+(total (list 1 2 3))
+(total (list 1 2 4))
+seen
+(define small (memoize (lambda (x) (begin (set! seen (+ seen 1)) (* x x))) 2))
+(small 1)
+(small 2)
+(small 1)
+(small 3)
+(small 1)
+(small 2)
+(memo-stats small)
+(define (outer n) (begin (define-memo (inner k) (if (equal? k 0) 0 (+ n (inner (- k 1))))) (inner 100)))
+(outer 3)
+(memoize 5)
+(memoize car 0)
+(memo-stats car)
+(define-memo (f))
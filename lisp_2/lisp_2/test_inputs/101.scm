@@ -0,0 +1,35 @@
+(+ 1 (* 2 3))
+(if (> 3 2) (- 10 4) (car 5))
+(if (< 3 2) (car 5) 8)
+(if #f (car 5) 9)
+(define (sq x) (* x x))
+(sq 7)
+(define (sum-sq a b) (+ (sq a) (sq b)))
+(sum-sq 3 4)
+(sum-sq 3)
+(define (first l) (car l))
+(first 5)
+(first (list 4 5))
+(define (never) (car 5))
+(if #t 1 (never))
+(never)
+(define (shadow +) (+ 2 3))
+(shadow -)
+(define (inner-define) (begin (define car cdr) (car (list 1 2))))
+(car (inner-define))
+(let ((* +)) (* 2 3))
+(define (half y) (/ y 2))
+(let ((z 10)) (half z))
+(define calls 0)
+(define (bump) (begin (set! calls (+ calls 1)) calls))
+(define (ignore x) 5)
+(ignore (bump))
+calls
+(define (fact n) (if (equal? n 0) 1 (* n (fact (- n 1)))))
+(fact 10)
+(define (outer y) (let ((sq (lambda (z) y))) (sq 1)))
+(outer 42)
+(begin (define + -) (+ 10 3))
+(+ 10 3)
+(begin 1 2 3)
+(if)
@@ -0,0 +1,31 @@
+(define board (make-ndarray (list 3 4)))
+(if (ndarray? board) 1 0)
+(nd-shape board)
+(nd-ref board (list 2 3))
+(nd-set! board (list 1 2) 7)
+(nd-ref board (list 1 2))
+(nd-ref board (vector 1 2))
+(nd-sum board)
+(nd-fill! board 2)
+(nd-sum board)
+(nd-ref board (list 1 2))
+(nd-set! board (list 0 0) 0.5)
+(nd-sum board)
+(define ones (make-ndarray (list 3 4) 1))
+(nd-sum (nd+ board ones))
+(nd-sum (nd* ones 3))
+(nd-ref (nd* (nd+ ones ones) (nd+ ones 4)) (list 2 2))
+(nd-neighbors board (list 0 0))
+(nd-neighbors board (list 1 1))
+(length (nd-neighbors (make-ndarray (list 5 5 5)) (list 2 2 2)))
+(define cube (make-ndarray (list 2 3 4) 0))
+(begin (for-each (lambda (cell) (nd-set! cube cell 1)) (nd-neighbors cube (list 1 2 3))) (nd-sum cube))
+(nd-ref cube (list 0 1 2))
+(nd-ref cube (list 0 0 2))
+(if (equal? (make-ndarray (list 2) 1) (nd+ (make-ndarray (list 2)) 1)) 1 0)
+(nd-ref board (list 3 0))
+(nd-ref board (list 1))
+(nd-set! board (list 0 0) (list 1))
+(nd+ board (make-ndarray (list 4 3)))
+(make-ndarray (list 0 2))
+(nd-sum 5)
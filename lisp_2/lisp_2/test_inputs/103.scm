@@ -0,0 +1,19 @@
+(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(pmap fib (range 15) 4 2)
+(define (scale k) (lambda (x) (* k (fib x))))
+(pmap (scale 3) (list 1 2 3 10) 1 2)
+(pmap car (list (list 1 2) (list 3) (list 4 5)) 2 2)
+(pmap (lambda (x) (+ x 1)) nil 1 2)
+(define calls 0)
+(pmap (lambda (x) (begin (set! calls (+ calls 1)) calls)) (list 1 2 3 4) 2 2)
+calls
+(map (lambda (g) (g)) (pmap (lambda (x) (lambda () (* x x))) (list 5 6) 1 2))
+(define-memo (memo-fib n) (if (< n 2) n (+ (memo-fib (- n 1)) (memo-fib (- n 2)))))
+(pmap memo-fib (list 50 60) 1 2)
+(pmap (lambda (x) (stream-take (integers-from x) 3)) (list 1 10) 1 2)
+(pmap (lambda (x) (car x)) (list (list 1) 2) 1 2)
+(pmap (lambda (x) undefined-name) (list 1 2) 1 2)
+(pmap (lambda (x) x) (cons-stream 1 2) 1 2)
+(pmap fib (list 1 2) 0)
+(pmap 5 (list 1 2))
+(pmap fib)
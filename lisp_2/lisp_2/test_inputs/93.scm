@@ -0,0 +1,19 @@
+(define (count-down n) (if (equal? n 0) 0 (count-down (- n 1))))
+(count-down 100000)
+(define (loop n acc) (if (> n 0) (loop (- n 1) (+ acc 1)) acc))
+(loop 100000 0)
+(define (is-even? n) (or (equal? n 0) (is-odd? (- n 1))))
+(define (is-odd? n) (and (not (equal? n 0)) (is-even? (- n 1))))
+(if (is-even? 100000) 1 0)
+(if (is-odd? 100001) 1 0)
+(if (is-odd? 100000) 1 0)
+(define (let-loop n) (let ((m (- n 1))) (if (< m 0) n (let-loop m))))
+(let-loop 100000)
+(define (begin-loop n) (begin (define m (- n 1)) (if (< m 0) 7 (begin-loop m))))
+(begin-loop 100000)
+(define (tail-builtin n) (if (equal? n 0) (+ 1 2) (tail-builtin (- n 1))))
+(tail-builtin 50000)
+(define (and-last n) (and #t n))
+(if (equal? (and-last 5) #t) 1 0)
+(define (not-tail n) (if (equal? n 0) 0 (+ 1 (not-tail (- n 1)))))
+(not-tail 1000)
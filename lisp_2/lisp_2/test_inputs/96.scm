@@ -0,0 +1,28 @@
+(define v (make-vector 3))
+(vector->list v)
+(define w (vector 1 2 3 4))
+(vector-length w)
+(length w)
+(vector-ref w 0)
+(vector-ref w 3)
+(vector-ref w 4)
+(vector-ref w -1)
+(vector-set! w 1 20)
+(vector->list w)
+(vector->list (make-vector 2 7))
+(vector->list (list->vector (list 5 6 7)))
+(vector-length (list->vector nil))
+(list->vector (cons 1 2))
+(vector->list (vector-map (lambda (x) (* x x)) w))
+(vector->list (vector-map + w (vector 10 10 10)))
+(if (equal? (vector 1 2) (vector 1 2)) 1 0)
+(if (equal? (vector 1 2) (vector 1 3)) 1 0)
+(if (equal? (vector 1 2) (list 1 2)) 1 0)
+(if (vector? w) 1 0)
+(if (vector? (list 1)) 1 0)
+(define (fill-squares! vec i) (if (equal? i (vector-length vec)) vec (begin (vector-set! vec i (* i i)) (fill-squares! vec (+ i 1)))))
+(vector-ref (fill-squares! (make-vector 30000) 0) 29999)
+(vector-ref (list 1 2) 0)
+(make-vector -1)
+(make-vector #t 0)
+(vector-ref w #f)
@@ -0,0 +1,18 @@
+(map (lambda (x) (* 2 x)) (list 1 2 3))
+(map + (list 1 2 3) (list 10 20 30))
+(map + (list 1 2 3) (list 10 20))
+(map (lambda (a b c) (list a b c)) (list 1 2) (list 3 4) (list 5 6))
+(map (lambda (x) x) nil)
+(map (lambda (x) (+ x 1)) (vector 1 2 3))
+(filter (lambda (x) (> x 1)) (vector 1 2 3))
+(reduce + (vector 1 2 3) 10)
+(map car (list (list 1 2) (list 3 4)))
+(define (identity x) x)
+(define list (lambda (x) 42))
+(map identity (cons 1 (cons 2 nil)))
+(map identity 5)
+(filter identity (cons 1 2))
+(define (countdown n) (if (equal? n 0) nil (cons n (countdown (- n 1)))))
+(length (define big (countdown 2000)))
+(reduce + (map (lambda (x) (* x 2)) (filter (lambda (x) (> x 1000)) big)) 0)
+(map identity)
@@ -0,0 +1,30 @@
+(define count 0)
+(define p (delay (begin (set! count (+ count 1)) (* 6 7))))
+count
+(force p)
+(force p)
+count
+(force 5)
+(force (make-promise 9))
+(define (ints n) (cons-stream n (ints (+ n 1))))
+(stream-car (define nat (ints 0)))
+(stream-car nat)
+(stream-car (stream-cdr (stream-cdr nat)))
+(stream-take nat 5)
+(stream-take (stream-map (lambda (x) (* x x)) (integers-from 1)) 5)
+(stream-take (stream-map + nat (integers-from 100)) 3)
+(stream-take (stream-filter (lambda (x) (> x 10)) (integers-from 1)) 3)
+(define (even? n) (if (equal? n 0) #t (if (equal? n 1) #f (even? (- n 2)))))
+(stream-take (stream-filter even? (stream-map (lambda (x) (+ x 3)) (integers-from 0))) 4)
+(stream-car (stream-filter (lambda (x) (> x 50000)) (integers-from 0)))
+(stream-take (cons-stream 1 (cons-stream 2 nil)) 10)
+(define calls 0)
+(define (noisy n) (cons-stream n (begin (set! calls (+ calls 1)) (noisy (+ n 1)))))
+(stream-car (define s (noisy 0)))
+(stream-take s 4)
+(stream-take s 4)
+calls
+(stream-car nil)
+(stream-take nat -1)
+(delay)
+(stream-take nat #t)
@@ -0,0 +1,50 @@
+(range 5)
+(range 2 6)
+(range 10 0 -3)
+(range 3 3)
+(length (range 100000))
+(iota 4)
+(iota 4 1)
+(iota 3 0 5)
+(reverse (list 1 2 3 4))
+(reverse nil)
+(length (reverse (range 100000)))
+(list-tail (list 1 2 3 4) 2)
+(list-tail (list 1 2) 2)
+(member 3 (list 1 2 3 4))
+(if (member 7 (list 1 2 3)) 1 0)
+(length (define alist (list (cons 1 10) (cons 2 20) (cons 3 30))))
+(cdr (assoc 2 alist))
+(if (assoc 9 alist) 1 0)
+(last-pair (list 1 2 3))
+(define a (list 1 2 3))
+(define b (list-copy a))
+(if (equal? (car a) (car b)) 1 0)
+(sort (list 3 1 2 5 4))
+(sort (list 3 1 2 5 4) >)
+(sort (list (list 2 1) (list 1 2) (list 2 0) (list 1 1)) (lambda (x y) (< (car x) (car y))))
+(map (lambda (x) (car (cdr x))) (sort (list (list 2 1) (list 1 2) (list 2 0) (list 1 1)) < car))
+(define total 0)
+(for-each (lambda (x) (set! total (+ total x))) (range 1 11))
+total
+(for-each (lambda (x y) (set! total (+ total (* x y)))) (list 1 2 3) (list 10 20))
+total
+(fold-left - 0 (list 1 2 3))
+(fold-right - 0 (list 1 2 3))
+(cdr (fold-left cons nil (list 1 2 3)))
+(fold-right cons nil (list 1 2 3))
+(fold-left + 0 (list 1 2 3) (list 10 20 30))
+(fold-left + 0 (range 100000))
+(fold-right + 0 (range 100000))
+(range 1 2 0)
+(range 1.5)
+(list-tail (list 1 2) 3)
+(sort (list 1 2) 5)
+(sort (list 1 (list 2)))
+(fold-left + 0)
+(iota 3 car)
+(iota 3 0 #t)
+(iota 3 0.5 2)
+(fold-left + 0 (vector 1 2 3) (list 10 20))
+(fold-right cons nil (vector 1 2))
+(begin (for-each (lambda (x) (set! total (+ total x))) (vector 1 2)) total)